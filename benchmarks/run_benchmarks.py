@@ -0,0 +1,390 @@
+"""
+Benchmark of the fitting and rendering pipeline
+
+Measure wall time, memory, optimizer evaluations and HTML size of the main steps
+of the daily update on the bundled full_data.csv and on synthetic logistic series.
+Results are written as JSON so that two commits can be compared:
+
+    python benchmarks/run_benchmarks.py --n-bootstrap 50 --output before.json
+    python benchmarks/run_benchmarks.py --n-bootstrap 50 --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_PATH))
+
+import bokeh.models as bkm
+from bokeh.embed import file_html
+from bokeh.resources import Resources
+
+from src import bokeh_plot, kernels
+from src.utils import (
+    SigmoidModel,
+    compute_countries_predictions,
+    compute_moving_predictions,
+    compute_panel_predictions,
+    data_china_smoothing,
+    get_country_and_min_count,
+    panel_country_kwargs,
+    sigmoid,
+)
+
+
+def synthetic_dataset(n_days=200, n_countries=5, seed=0):
+    """
+    Generate noisy logistic series of total cases with the columns of the covid dataset
+
+    Parameters
+    ----------
+    n_days: number of days of each series
+    n_countries: number of locations
+    seed: seed of the random generator
+
+    Returns
+    -------
+    pd.DataFrame with the columns date, location, new_cases, total_cases,
+    new_deaths, total_deaths and date_str
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=n_days, freq="d")
+    t = np.arange(1, n_days + 1)
+
+    countries = []
+    for k in range(n_countries):
+        K = 10 ** rng.uniform(4, 7)
+        x0 = rng.uniform(0.3, 0.7) * n_days
+        r = rng.uniform(0.03, 0.15)
+
+        new_cases = np.diff(sigmoid(t, x0, K, r), prepend=0)
+        new_cases = np.maximum(new_cases * rng.lognormal(0, 0.2, n_days), 0)
+        total_cases = np.cumsum(new_cases).round()
+        total_deaths = (0.02 * total_cases).round()
+
+        countries.append(
+            pd.DataFrame(
+                {
+                    "date": dates,
+                    # --- generate_plot displays World by default --- #
+                    "location": "World" if k == 0 else f"Country {k}",
+                    "new_cases": np.diff(total_cases, prepend=0).astype(int),
+                    "total_cases": total_cases,
+                    "new_deaths": np.diff(total_deaths, prepend=0).astype(int),
+                    "total_deaths": total_deaths,
+                }
+            )
+        )
+
+    data = pd.concat(countries, ignore_index=True)
+    data["date_str"] = data.date.dt.strftime("%d/%m/%Y")
+
+    return data
+
+
+def load_full_data():
+    """read the bundled full_data.csv with the columns used by the pipeline"""
+    data = pd.read_csv(ROOT_PATH / "full_data.csv").dropna()
+    data["date"] = pd.to_datetime(data.date, format="%Y-%m-%d")
+    data["date_str"] = data.date.dt.strftime("%d/%m/%Y")
+
+    return data
+
+
+def _max_rss_mb():
+    """peak resident memory of the current process in MB"""
+    # --- ru_maxrss is in kilobytes on linux and in bytes on macOS --- #
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (
+        2**20 if sys.platform == "darwin" else 2**10
+    )
+
+
+def _child_peak_rss(func, connection):
+    """run func and send the peak resident memory before and after it"""
+    start = _max_rss_mb()
+    func()
+    connection.send((start, _max_rss_mb()))
+
+
+def peak_rss(func):
+    """
+    Run func in a forked child process, so that its peak resident memory is not the
+    peak of the previous stages of the benchmark
+
+    Returns
+    -------
+    peak resident memory of the child in MB, increase of the peak of the child
+    during func in MB, None, None where fork is not available
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None, None
+
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child_peak_rss, args=(func, sender))
+    process.start()
+    sender.close()
+    try:
+        start, peak = receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"child process failed with code {process.exitcode}")
+    finally:
+        process.join()
+
+    return peak, peak - start
+
+
+def measure(name, func, repeat=1):
+    """
+    Run func repeat times and measure its best wall time, then run it once more
+    under tracemalloc to measure the peak of the python allocations and once in a
+    child process to measure the peak resident memory, so that neither slows down
+    the timed runs
+
+    Returns
+    -------
+    result of the last timed call, dictionary of the measures
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    peak_rss_mb, rss_increase_mb = peak_rss(func)
+
+    measures = {
+        "stage": name,
+        "wall_time_s": min(times),
+        "peak_traced_mb": peak_traced / 2**20,
+        "peak_rss_mb": peak_rss_mb,
+        "rss_increase_mb": rss_increase_mb,
+    }
+    print(
+        f"{name:<40} {measures['wall_time_s']:>9.3f}s "
+        f"{measures['peak_traced_mb']:>9.1f}MB traced "
+        f"{peak_rss_mb or float('nan'):>9.1f}MB rss "
+        f"(+{rss_increase_mb or float('nan'):.1f}MB)"
+    )
+
+    return result, measures
+
+
+def warm_up(model_kwargs, seed=0):
+    """
+    fit a short synthetic series with the solver of model_kwargs and the batched
+    solver so that the compilation of the kernels is not part of any measure
+    """
+    X = get_country_and_min_count(synthetic_dataset(60, 1, seed), "World")
+    for solver in {model_kwargs["solver"], "batched"}:
+        SigmoidModel(
+            random_state=seed, **{**model_kwargs, "n_bootstrap": 2, "solver": solver}
+        ).fit(X)
+
+
+def run_benchmarks(args):
+    """run every stage and return the list of their measures"""
+    results = []
+    model_kwargs = dict(
+        n_bootstrap=args.n_bootstrap,
+        linear_proba=True,
+        solver=args.solver,
+        bootstrap=args.bootstrap,
+    )
+
+    warm_up(model_kwargs, args.seed)
+
+    datasets = {
+        "synthetic": synthetic_dataset(args.n_days, args.n_countries, args.seed),
+        "full_data": load_full_data(),
+    }
+    locations = {
+        "synthetic": sorted(datasets["synthetic"].location.unique()),
+        "full_data": ["World"],
+    }
+
+    for dataset_name, data in datasets.items():
+        for location in locations[dataset_name]:
+            X = get_country_and_min_count(data, location)
+            model = SigmoidModel(random_state=args.seed, **model_kwargs)
+
+            _, measures = measure(
+                f"fit[{dataset_name}:{location}]", lambda: model.fit(X), args.repeat
+            )
+            measures["n_evaluations"] = model.n_evaluations
+            measures.update(model.convergence_summary())
+            results.append(measures)
+
+            t_pred = np.arange(1, X.shape[0] + args.horizon, 1)
+            _, measures = measure(
+                f"predict[{dataset_name}:{location}]",
+                lambda: model.predict(t_pred, X),
+                args.repeat,
+            )
+            results.append(measures)
+
+    # --- moving predictions of every synthetic country --- #
+    data = datasets["synthetic"]
+    predictions = []
+
+    def moving_predictions():
+        predictions.clear()
+        for location in locations["synthetic"]:
+            X = get_country_and_min_count(data, location)
+            fitted, _ = compute_moving_predictions(
+                X,
+                n_prediction=X.shape[0] + args.horizon,
+                min_data=X.shape[0] - args.n_windows + 1,
+                step=1,
+                random_state=args.seed,
+                **model_kwargs,
+            )
+            fitted["location"] = location
+            predictions.append(fitted)
+
+    _, measures = measure("compute_moving_predictions", moving_predictions, 1)
+    results.append(measures)
+    df_all_prediction = pd.concat(predictions)
+
+    # --- every location of full_data fitted window by window and as a panel --- #
+    country_kwargs = panel_country_kwargs(
+        datasets["full_data"], n_windows=args.n_windows
+    )
+    countries_kwargs = dict(
+        n_bootstrap=args.n_bootstrap,
+        linear_proba=True,
+        bootstrap=args.bootstrap,
+        step=1,
+        random_state=args.seed,
+    )
+    for name, compute in [
+        (
+            "compute_countries_predictions[batched]",
+            lambda: compute_countries_predictions(
+                country_kwargs, solver="batched", **countries_kwargs
+            ),
+        ),
+        (
+            "compute_panel_predictions",
+            lambda: compute_panel_predictions(country_kwargs, **countries_kwargs),
+        ),
+    ]:
+        _, measures = measure(name, compute, 1)
+        measures["n_fits"] = len(country_kwargs) * args.n_windows
+        results.append(measures)
+
+    _, measures = measure(
+        "data_china_smoothing",
+        lambda: data_china_smoothing(datasets["full_data"], n_days_smoothing=6),
+        args.repeat,
+    )
+    results.append(measures)
+
+    for compact in [False, True]:
+
+        def render():
+            select, button_prediction, slider, p = bokeh_plot.generate_plot(
+                data, df_all_prediction, compact=compact
+            )
+            return file_html(
+                bkm.Column(bkm.Row(select, button_prediction, slider), p),
+                Resources(mode="cdn"),
+                "plot",
+            )
+
+        html, measures = measure(f"generate_plot[compact={compact}]", render, 1)
+        measures["html_size_kb"] = len(html.encode()) / 2**10
+        results.append(measures)
+
+    return results
+
+
+def git_revision():
+    """return the current git commit, None outside of a git repository"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_PATH, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    """print the ratio of each measure to the same measure of a previous run"""
+    with open(previous_path) as f:
+        previous = {r["stage"]: r for r in json.load(f)["results"]}
+
+    print(f"\nratio to {previous_path} (< 1 is better)")
+    for measures in results:
+        before = previous.get(measures["stage"])
+        if before is None:
+            continue
+        ratios = [
+            f"{key}={measures[key] / before[key]:.2f}"
+            for key in measures
+            if key != "stage" and before.get(key) and measures[key] is not None
+        ]
+        print(f"{measures['stage']:<40} " + " ".join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-days", type=int, default=200)
+    parser.add_argument("--n-countries", type=int, default=3)
+    parser.add_argument("--n-bootstrap", type=int, default=20)
+    parser.add_argument("--n-windows", type=int, default=5)
+    parser.add_argument("--horizon", type=int, default=300)
+    parser.add_argument("--solver", default="nelder-mead")
+    parser.add_argument("--bootstrap", default="resample")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    report = {
+        "revision": git_revision(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "loss_backend": kernels.BACKEND,
+        "parameters": {key: str(value) for key, value in vars(args).items()},
+        "results": results,
+    }
+
+    output = args.output or ROOT_PATH / "benchmarks" / "results" / (
+        f"{report['revision'] or 'local'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,8 @@
 
 source $HOME/.zshrc
 conda activate covid19
-cd /Users/Francois/Documents/Programmation/Python/Divers/Coronavirus/src
-python generate_plot_html.py
-cd ..
+cd /Users/Francois/Documents/Programmation/Python/Divers/Coronavirus
+python -m src.generate_plot_html
 current_date=$(date +"%d/%m/%y")
 git add .
 git commit -m "updated data $current_date"
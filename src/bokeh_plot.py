@@ -2,16 +2,221 @@ import bokeh.plotting as bkp
 import bokeh.models as bkm
 from bokeh.palettes import d3
 
+import base64
+import json
 import pathlib
 import datetime
 
-from src.utils import get_country
+from src.files import atomic_write
+from src.utils import get_country, LocationIndex
 import numpy as np
 
 includes_path = pathlib.Path("../_includes/")
 
+# --- columns read by the glyphs, tooltips and callbacks --- #
+DATA_COLUMNS = [
+    "date",
+    "date_str",
+    "total_cases",
+    "new_cases",
+    "total_deaths",
+    "new_deaths",
+]
+PREDICTION_COLUMNS = [
+    "date",
+    "date_str",
+    "date_end_train",
+    "25%",
+    "median",
+    "75%",
+    "derivative",
+    "median_display",
+]
+
+# --- dtypes of the embedded columns in compact mode, dates are days since epoch --- #
+COMPACT_DATA_DTYPES = {
+    "date": "int32",
+    "total_cases": "int32",
+    "new_cases": "int32",
+    "total_deaths": "int32",
+    "new_deaths": "int32",
+}
+COMPACT_PREDICTION_DTYPES = {
+    "date": "int32",
+    "25%": "float32",
+    "median": "float32",
+    "75%": "float32",
+    "derivative": "float32",
+}
+
+# --- mantissa bits kept in the float columns of the shards, about 4 significant --- #
+# --- digits, the zeroed low bits make the shards compress better in git        --- #
+SHARD_MANTISSA_BITS = 12
+
+
+def location_offsets(index: LocationIndex):
+    """return the [start, stop] rows of each location of a LocationIndex"""
+    return {
+        location: [int(start), int(stop)]
+        for location, (start, stop) in index.offsets.items()
+    }
+
+
+def window_offsets(prediction_index: LocationIndex):
+    """
+    return for each location the first row of each of its training windows followed
+    by its last row, the predictions of a location being sorted by date_end_train
+    """
+    offsets = {}
+    date_end_train = prediction_index.data.date_end_train.values
+
+    for location, (start, stop) in prediction_index.offsets.items():
+        _, window_starts = np.unique(date_end_train[start:stop], return_index=True)
+        offsets[location] = [int(start + k) for k in window_starts] + [int(stop)]
+
+    return offsets
+
+
+def compact_columns(df, dtypes: dict):
+    """
+    return the columns of df listed in dtypes as numpy arrays of the given dtype,
+    bokeh embeds them as binary arrays, dates are converted to days since epoch
+    """
+    columns = {}
+    for column, dtype in dtypes.items():
+        values = df[column].values
+        if np.issubdtype(values.dtype, np.datetime64):
+            values = values.astype("datetime64[D]").astype(np.int64)
+        columns[column] = values.astype(dtype)
+
+    return columns
+
+
+def shard_name(location: str) -> str:
+    """return the file name of the predictions shard of location"""
+    return location.replace("/", "_").replace(" ", "_") + ".json"
+
+
+def round_mantissa(values, bits: int):
+    """round the finite values of a float32 array to bits bits of mantissa"""
+    drop = np.finfo(np.float32).nmant - bits
+    integers = values.view(np.uint32)
+    rounded = ((integers + np.uint32(1 << (drop - 1))) >> drop) << drop
+    return np.where(np.isfinite(values), rounded.view(np.float32), values)
+
+
+def write_prediction_shard(directory, location: str, df_prediction):
+    """
+    Write the predictions of a single location to its own shard file, read by the
+    page when the location is selected. The columns of COMPACT_PREDICTION_DTYPES are
+    stored as base64 encoded binary arrays with the first row of each training window,
+    the float columns are rounded to SHARD_MANTISSA_BITS. A shard whose content did
+    not change is not written again
+
+    Parameters
+    ----------
+    directory: folder of the shard files
+    location: location of the predictions
+    df_prediction: predictions of the location computed with compute_moving_predictions
+
+    Returns
+    -------
+    file name of the shard
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    df_prediction = df_prediction.sort_values("date_end_train", kind="stable")
+    _, window_starts = np.unique(df_prediction.date_end_train.values, return_index=True)
+
+    columns = compact_columns(df_prediction, COMPACT_PREDICTION_DTYPES)
+    for column, values in columns.items():
+        if values.dtype == np.float32:
+            columns[column] = round_mantissa(values, SHARD_MANTISSA_BITS)
+
+    shard = {
+        "location": location,
+        "windows": [int(k) for k in window_starts] + [int(df_prediction.shape[0])],
+        "columns": {
+            column: {
+                "dtype": str(values.dtype),
+                "data": base64.b64encode(values.tobytes()).decode("ascii"),
+            }
+            for column, values in columns.items()
+        },
+    }
+
+    name = shard_name(location)
+    content = json.dumps(shard, separators=(",", ":"))
+    path = directory / name
+    if path.exists() and path.read_text() == content:
+        return name
+
+    with atomic_write(path) as f:
+        f.write(content)
+
+    return name
+
+
+def read_prediction_shard(directory, location: str):
+    """
+    Read the predictions of a location written with write_prediction_shard
+
+    Parameters
+    ----------
+    directory: folder of the shard files
+    location: location of the predictions
+
+    Returns
+    -------
+    dictionary of the columns of COMPACT_PREDICTION_DTYPES, dates as datetime64[D],
+    list of the first row of each training window followed by the number of rows,
+    None if the location has no shard
+    """
+    try:
+        with open(pathlib.Path(directory) / shard_name(location)) as f:
+            shard = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    columns = {
+        column: np.frombuffer(base64.b64decode(encoded["data"]), dtype=encoded["dtype"])
+        for column, encoded in shard["columns"].items()
+    }
+    columns["date"] = columns["date"].astype("datetime64[D]")
+
+    return columns, shard["windows"]
+
 
-def generate_plot(data, df_all_prediction):
+# --- read the shard of a country on first use and decode its binary columns --- #
+LOAD_SHARD_JS = """
+        function load_prediction_shard(country, callback){
+            const cache = window.prediction_shards_cache = window.prediction_shards_cache || {}
+            if (cache[country] !== undefined){
+                callback(cache[country])
+                return
+            }
+            const arrays = {"int32": Int32Array, "float32": Float32Array}
+            fetch(shard_url + encodeURIComponent(prediction_shards[country]))
+                .then((response) => response.json())
+                .then((shard) => {
+                    const columns = {}
+                    for (const [column, encoded] of Object.entries(shard.columns)){
+                        const bytes = Uint8Array.from(atob(encoded.data), (c) => c.charCodeAt(0))
+                        columns[column] = new arrays[encoded.dtype](bytes.buffer)
+                    }
+                    cache[country] = {"columns": columns, "windows": shard.windows}
+                    callback(cache[country])
+                })
+        }
+"""
+
+
+def covid_tooltips(compact=False):
+    """
+    return the html tooltips of the observed data and of the predictions, reading the
+    columns of compact mode if compact is True
+    """
     COLORS = d3["Category10"][10]
 
     tooltips = f"""
@@ -50,41 +255,51 @@ def generate_plot(data, df_all_prediction):
         """
     )
 
-    hover = bkm.tools.HoverTool(names=["line_total"], tooltips=tooltips, mode="vline")
+    if compact:
+        # --- labels are formatted by the browser instead of embedded as strings --- #
+        tooltips = tooltips.replace("@date_str", "@date{%d/%m/%Y}")
+        for column in ["total_cases", "new_cases", "total_deaths", "new_deaths"]:
+            tooltips = tooltips.replace(f"@{column}<", f"@{column}{{0,0}}<")
 
-    hover_prediction = bkm.tools.HoverTool(
-        names=["prediction"],
-        tooltips=tooltips_predictions,
-    )
+        tooltips_predictions = tooltips_predictions.replace(
+            "@date_str", "@date{%d/%m/%Y}"
+        ).replace("@median_display", "@median{0,0}")
 
-    # --- define all DataSource needed --- #
+    return tooltips, tooltips_predictions
 
-    source_all = bkm.ColumnDataSource(data)
-    country = "World"
-    source = bkm.ColumnDataSource(get_country(data, country))
 
-    source_all_prediction = bkm.ColumnDataSource(df_all_prediction)
-    source_prediction = bkm.ColumnDataSource(get_country(df_all_prediction, country))
+def covid_figure(source, source_prediction_end_date, data_country, country, compact):
+    """
+    Build the covid 19 figure with the glyphs of source and of the predictions of
+    source_prediction_end_date, the predictions being hidden
 
-    date_end_training = np.unique(
-        get_country(df_all_prediction, country)["date_end_train"]
-    )[-1]
-    source_prediction_end_date = bkm.ColumnDataSource(
-        get_country(df_all_prediction, country)[
-            get_country(df_all_prediction, country).date_end_train == date_end_training
-        ]
-    )
+    Parameters
+    ----------
+    source: ColumnDataSource of the observed data of the displayed country
+    source_prediction_end_date: ColumnDataSource of the displayed predictions
+    data_country: observed data of the displayed country, sets the initial ranges
+    country: displayed country
+    compact: whether or not the sources hold the columns of compact mode
 
-    slider = bkm.Slider(
-        start=0,
-        end=len(np.unique(get_country(df_all_prediction, country)["date_end_train"]))
-        - 1,
-        value=0,
-        step=1,
-        title="Days dropped for prediction",
+    Returns
+    -------
+    figure, (median line, derivative line, lower band, upper band) of the predictions
+    """
+    COLORS = d3["Category10"][10]
+    tooltips, tooltips_predictions = covid_tooltips(compact)
+
+    hover = bkm.tools.HoverTool(
+        names=["line_total"],
+        tooltips=tooltips,
+        mode="vline",
+        formatters={"@date": "datetime"},
     )
 
-    # ----------- #
+    hover_prediction = bkm.tools.HoverTool(
+        names=["prediction"],
+        tooltips=tooltips_predictions,
+        formatters={"@date": "datetime"},
+    )
 
     p = bkp.figure(
         y_axis_type="linear",
@@ -95,12 +310,12 @@ def generate_plot(data, df_all_prediction):
         y_axis_label="Total number of Covid 19 cases",
         tools=[hover, "pan", "wheel_zoom", "reset"],
         x_range=[
-            get_country(data, country).date.min(),
-            get_country(data, country).date.max() + datetime.timedelta(days=1),
+            data_country.date.min(),
+            data_country.date.max() + datetime.timedelta(days=1),
         ],
         y_range=[
-            -get_country(data, country).total_cases.max() * 0.05,
-            get_country(data, country).total_cases.max() * 1.1,
+            -data_country.total_cases.max() * 0.05,
+            data_country.total_cases.max() * 1.1,
         ],
     )
     p.yaxis.formatter = bkm.formatters.NumeralTickFormatter(format="0,0")
@@ -114,8 +329,8 @@ def generate_plot(data, df_all_prediction):
 
     y_extra_range_max = np.max(
         [
-            np.max(get_country(data, country).new_cases.values),
-            np.max(get_country(data, country).total_deaths.values),
+            np.max(data_country.new_cases.values),
+            np.max(data_country.total_deaths.values),
         ]
     )
 
@@ -196,13 +411,6 @@ def generate_plot(data, df_all_prediction):
         muted_alpha=0.1,
     )
 
-    button_click_count = bkm.ColumnDataSource({"clicks": [0]})
-
-    select = bkm.Select(
-        title="Country: ", value=country, options=list(data.location.unique())
-    )
-    button_log = bkm.Button(label="Log Scale", button_type="primary")
-
     # --- Predictions --- #
 
     median_prediction = p.line(
@@ -252,6 +460,135 @@ def generate_plot(data, df_all_prediction):
     p.add_layout(band_low)
     p.add_layout(band_high)
 
+    p.legend.location = "top_left"
+    p.legend.click_policy = "mute"
+
+    return p, (median_prediction, prediction_cases_line, band_low, band_high)
+
+
+def generate_plot(
+    data, df_all_prediction, compact=False, shard_url=None, prediction_shards=None
+):
+    """
+    Build the covid 19 plot with its country select, prediction button and slider
+
+    Parameters
+    ----------
+    data: Covid 19 dataset
+    df_all_prediction: predictions of all countries computed with compute_moving_predictions,
+        only the predictions of the displayed country if shard_url is given
+    compact: whether or not to embed only the columns read by the plot as binary arrays,
+        dates and numbers labels are then formatted by the browser, default=False
+    shard_url: url of the folder of the predictions shards written with
+        write_prediction_shard, the predictions of a country are then loaded when it
+        is selected instead of embedded in the page, requires compact, default=None
+    prediction_shards: dictionary {location: shard file name}, default=None
+
+    Returns
+    -------
+    select, button_prediction, slider, figure
+    """
+    if shard_url is not None and not compact:
+        raise ValueError("predictions shards are only supported with compact=True")
+
+    data_columns = DATA_COLUMNS
+    prediction_columns = PREDICTION_COLUMNS
+
+    if compact:
+        # --- labels are formatted by the browser instead of embedded as strings --- #
+        data_columns = list(COMPACT_DATA_DTYPES)
+        prediction_columns = list(COMPACT_PREDICTION_DTYPES)
+
+    # --- define all DataSource needed --- #
+
+    country = "World"
+
+    # --- sort the datasets by location and training window so that the rows of a --- #
+    # --- country or of a window are contiguous and selected with their offsets   --- #
+    data_index = LocationIndex(data)
+    prediction_index = LocationIndex(
+        df_all_prediction.sort_values("date_end_train", kind="stable")
+    )
+    data_offsets = location_offsets(data_index)
+    prediction_offsets = window_offsets(prediction_index)
+
+    data_country = get_country(data_index, country)
+    prediction_country = get_country(prediction_index, country)
+    dates_end_training = np.unique(prediction_country["date_end_train"])
+    prediction_end_date = prediction_country[
+        prediction_country.date_end_train.isin(dates_end_training[-1:])
+    ]
+
+    # --- windows of the displayed country relatively to its first prediction --- #
+    start, _ = prediction_index.offsets.get(country, (0, 0))
+    prediction_windows = bkm.ColumnDataSource(
+        {
+            "offsets": [
+                offset - start for offset in prediction_offsets.get(country, [0, 0])
+            ]
+        }
+    )
+
+    if shard_url is None:
+        locations_predicted = list(prediction_offsets)
+    else:
+        # --- predictions of the other countries are read from their shard --- #
+        locations_predicted = list(prediction_shards)
+        prediction_offsets = {}
+
+    if compact:
+        source_all = bkm.ColumnDataSource(
+            compact_columns(data_index.data, COMPACT_DATA_DTYPES)
+        )
+        source_all_prediction = bkm.ColumnDataSource(
+            compact_columns(
+                (
+                    prediction_index.data.iloc[:0]
+                    if shard_url is not None
+                    else prediction_index.data
+                ),
+                COMPACT_PREDICTION_DTYPES,
+            )
+        )
+
+        # --- dictionaries of columns do not embed the DataFrame index --- #
+        source = bkm.ColumnDataSource(dict(data_country.loc[:, data_columns].items()))
+        source_prediction = bkm.ColumnDataSource(
+            dict(prediction_country.loc[:, prediction_columns].items())
+        )
+        source_prediction_end_date = bkm.ColumnDataSource(
+            dict(prediction_end_date.loc[:, prediction_columns].items())
+        )
+    else:
+        source_all = bkm.ColumnDataSource(data_index.data)
+        source_all_prediction = bkm.ColumnDataSource(prediction_index.data)
+
+        source = bkm.ColumnDataSource(data_country)
+        source_prediction = bkm.ColumnDataSource(prediction_country)
+        source_prediction_end_date = bkm.ColumnDataSource(prediction_end_date)
+
+    slider = bkm.Slider(
+        start=0,
+        end=len(dates_end_training) - 1,
+        value=0,
+        step=1,
+        title="Days dropped for prediction",
+    )
+
+    # ----------- #
+
+    p, prediction_renderers = covid_figure(
+        source, source_prediction_end_date, data_country, country, compact
+    )
+    median_prediction, prediction_cases_line, band_low, band_high = prediction_renderers
+
+    button_click_count = bkm.ColumnDataSource({"clicks": [0]})
+
+    select = bkm.Select(
+        title="Country: ", value=country, options=list(data.location.unique())
+    )
+    button_log = bkm.Button(label="Log Scale", button_type="primary")
+
     button_prediction = bkm.Button(label="Show predictions", button_type="primary")
 
     # -- Callback -- #
@@ -260,6 +597,10 @@ def generate_plot(data, df_all_prediction):
         args=dict(
             source=source,
             source_all=source_all,
+            data_offsets=data_offsets,
+            data_columns=data_columns,
+            prediction_columns=prediction_columns,
+            compact=compact,
             select=select,
             x_range=p.x_range,
             y_range_left=p.y_range,
@@ -268,6 +609,10 @@ def generate_plot(data, df_all_prediction):
             button_click_count=button_click_count,
             slider=slider,
             source_all_prediction=source_all_prediction,
+            prediction_offsets=prediction_offsets,
+            prediction_windows=prediction_windows,
+            shard_url=shard_url,
+            prediction_shards=prediction_shards or {},
             source_prediction=source_prediction,
             source_prediction_end_date=source_prediction_end_date,
             median_prediction=median_prediction,
@@ -275,165 +620,96 @@ def generate_plot(data, df_all_prediction):
             prediction_cases_line=prediction_cases_line,
             band_high=band_high,
         ),
-        code="""
+        code=LOAD_SHARD_JS + """
         var country = select.value
-    
-        var date = source_all.data['date']
-        var date_str = source_all.data['date_str']
-        var location = source_all.data['location']
-        var total_cases = source_all.data['total_cases']
-        var new_cases = source_all.data['new_cases']
-        var total_deaths = source_all.data['total_deaths']
-        var new_deaths = source_all.data['new_deaths']
-    
-    
-        var new_date = []
-        var new_date_str = []
-        var new_total_cases = []
-        var new_new_cases = []
-        var new_total_deaths = []
-        var new_new_deaths = []
-    
-    
-        for(var i=0; i < date.length; i++){
-            if(location[i]==country){
-                new_date.push(date[i]);
-                new_date_str.push(date_str[i])
-                new_total_cases.push(total_cases[i]);
-                new_new_cases.push(new_cases[i]);
-                new_total_deaths.push(total_deaths[i]);
-                new_new_deaths.push(new_deaths[i]);
+
+        // rows of the country are contiguous: copy them with their offsets,
+        // compact dates are days since epoch converted back to milliseconds
+
+        function take(columns, column, start, stop){
+            const values = columns[column].slice(start, stop)
+            if (compact && column == 'date'){
+                return Float64Array.from(values, (day) => day * 86400000)
             }
+            return values
+        }
+
+        const [start, stop] = data_offsets[country]
+        for (const column of data_columns){
+            source.data[column] = take(source_all.data, column, start, stop)
         }
-    
-        source.data['date']=new_date;
-        source.data['date_str']=new_date_str;
-        source.data['total_cases']=new_total_cases;
-        source.data['new_cases']=new_new_cases;
-        source.data['total_deaths']=new_total_deaths;
-        source.data['new_deaths']=new_new_deaths;
-    
-        const new_cases_no_Nan = new_new_cases.filter(function (value) {
+
+        var new_new_cases = source.data['new_cases']
+        var new_total_cases = source.data['total_cases']
+        var new_total_deaths = source.data['total_deaths']
+        var new_date = source.data['date']
+
+        const new_cases_no_Nan = Array.from(new_new_cases).filter(function (value) {
             return !Number.isNaN(value);
         });
-        const cases_no_Nan = new_total_cases.filter(function (value) {
+        const cases_no_Nan = Array.from(new_total_cases).filter(function (value) {
             return !Number.isNaN(value);
         });
-    
-        y_range_right.setv({"start": -0.05*Math.max.apply(Math, new_cases_no_Nan.concat(new_total_deaths)), 
-                            "end": 1.1*Math.max.apply(Math, new_cases_no_Nan.concat(new_total_deaths))})
-    
-        y_range_left.setv({"start": -0.05*Math.max.apply(Math, cases_no_Nan), 
+        const y_range_right_values = new_cases_no_Nan.concat(Array.from(new_total_deaths))
+
+        y_range_right.setv({"start": -0.05*Math.max.apply(Math, y_range_right_values),
+                            "end": 1.1*Math.max.apply(Math, y_range_right_values)})
+
+        y_range_left.setv({"start": -0.05*Math.max.apply(Math, cases_no_Nan),
                            "end": 1.1*Math.max.apply(Math, cases_no_Nan)})
-    
+
         x_range.setv({"start": Math.min.apply(Math, new_date), "end": 1.0001*Math.max.apply(Math, new_date)})
-    
+
         title.text = "Evolution du nombre de cas en " + country
-    
+
         source.change.emit();
-    
-    
+
+
         // change value of predictions
-    
+
         button_click_count.data.clicks = 0
-    
+
         median_prediction.visible = false
         band_low.visible = false
         band_high.visible = false
         prediction_cases_line.visble = false
-    
-        var date_end_prediction = source_all_prediction.data['date_end_train']
-    
-        var location = source_all_prediction.data['location']
-        var date = source_all_prediction.data['date']
-        var date_str = source_all_prediction.data['date_str']
-        var quantile_1 = source_all_prediction.data['25%']
-        var quantile_2 = source_all_prediction.data['median']
-        var quantile_3 = source_all_prediction.data['75%']
-        var new_cases = source_all_prediction.data['derivative']
-        var median_prediction = source_all_prediction.data['median_display']
-    
-        var new_date = []
-        var new_date_str = []
-        var new_date_end_prediction = []
-        var new_quantile_1 = []
-        var new_quantile_2 = []
-        var new_quantile_3 = []
-        var new_new_cases = []
-        var new_median_prediction = []
-    
-        for(var i=0; i < quantile_1.length; i++){
-            if(location[i]==country){
-                new_date.push(date[i])
-                new_date_str.push(date_str[i])
-                new_date_end_prediction.push(date_end_prediction[i])
-                new_quantile_1.push(quantile_1[i]);
-                new_quantile_2.push(quantile_2[i]);
-                new_quantile_3.push(quantile_3[i]);
-                new_new_cases.push(new_cases[i]);
-                new_median_prediction.push(median_prediction[i]);
-            }
-        }   
-        source_prediction.data['date']=new_date
-        source_prediction.data['date_str']=new_date_str
-        source_prediction.data['date_end_train']=new_date_end_prediction
-        source_prediction.data['25%']=new_quantile_1;
-        source_prediction.data['median']=new_quantile_2;
-        source_prediction.data['75%']=new_quantile_3;
-        source_prediction.data['derivative']=new_new_cases;
-        source_prediction.data['median_display']=new_median_prediction;
-    
-    
-        var n = new_date.length
-        var max_date = Math.max.apply(Math, new_date_end_prediction)
-    
-        var new_date_bis = []
-        var new_date_str_bis = []
-        var new_date_end_prediction_bis = []
-        var new_quantile_1_bis = []
-        var new_quantile_2_bis = []
-        var new_quantile_3_bis = []
-        var new_new_cases_bis = []
-        var new_median_prediction_bis = []
-    
-        for(var i=0; i < n; i++){
-            if(new_date_end_prediction[i]==max_date){
-                new_date_bis.push(new_date[i])
-                new_date_str_bis.push(new_date_str[i])
-                new_date_end_prediction_bis.push(new_date_end_prediction[i])
-                new_quantile_1_bis.push(new_quantile_1[i]);
-                new_quantile_2_bis.push(new_quantile_2[i]);
-                new_quantile_3_bis.push(new_quantile_3[i]);
-                new_new_cases_bis.push(new_new_cases[i]);
-                new_median_prediction_bis.push(new_median_prediction[i]);
+
+        // all the windows of the country and the last one
+
+        function show_predictions(columns, windows){
+            const n_windows = Math.max(windows.length - 1, 1)
+            const first = windows[0]
+            const last = windows[windows.length - 1]
+
+            for (const column of prediction_columns){
+                source_prediction.data[column] = take(columns, column, first, last)
+                source_prediction_end_date.data[column] = take(columns, column, windows[n_windows - 1], last)
             }
+            prediction_windows.data['offsets'] = windows.map((offset) => offset - first)
+
+            source_prediction.change.emit();
+            source_prediction_end_date.change.emit()
+
+            // change slider value
+
+            slider.setv({"end": n_windows - 1, "value": 0})
         }
-    
-        var n = new_date_bis.length
-        var max_date = Math.max.apply(Math, new_date_end_prediction_bis)
-    
-        source_prediction_end_date.data['date']=new_date_bis
-        source_prediction_end_date.data['date_str']=new_date_str_bis
-        source_prediction_end_date.data['date_end_train']=new_date_end_prediction_bis
-        source_prediction_end_date.data['25%']=new_quantile_1_bis;
-        source_prediction_end_date.data['median']=new_quantile_2_bis;
-        source_prediction_end_date.data['75%']=new_quantile_3_bis;
-        source_prediction_end_date.data['derivative']=new_new_cases_bis;
-        source_prediction_end_date.data['median_display']=new_median_prediction_bis;
-    
-        source_prediction.change.emit();
-        source_prediction_end_date.change.emit()
-    
-    
-    
-        const unique = (value, index, self) => {
-                   return self.indexOf(value) === index
-               }
-    
-        // change slider value
-    
-        slider.setv({"end": new_date_end_prediction.filter(unique).length - 1, "value": 0})
-    
+
+        if (shard_url === null){
+            show_predictions(source_all_prediction.data, prediction_offsets[country] || [0, 0])
+        }
+        else if (prediction_shards[country] === undefined){
+            show_predictions(source_all_prediction.data, [0, 0])
+        }
+        else{
+            load_prediction_shard(country, (shard) => {
+                // ignore a shard received after another country was selected
+                if (select.value == country){
+                    show_predictions(shard.columns, shard.windows)
+                }
+            })
+        }
+
         """,
     )
 
@@ -452,7 +728,7 @@ def generate_plot(data, df_all_prediction):
         args=dict(
             source=source,
             source_prediction=source_prediction,
-            source_all_prediction=source_all_prediction,
+            locations_predicted=locations_predicted,
             source_prediction_end_date=source_prediction_end_date,
             select=select,
             button_prediction=button_prediction,
@@ -466,11 +742,6 @@ def generate_plot(data, df_all_prediction):
             y_range_right=p.extra_y_ranges["Number of deaths"],
         ),
         code="""
-           // function to get unique value of an array
-           const unique = (value, index, self) => {
-               return self.indexOf(value) === index
-           }
-
            var date = source.data['date'];
            var total_cases = source.data['total_cases'];
            var new_cases = source.data['new_cases'];
@@ -479,10 +750,10 @@ def generate_plot(data, df_all_prediction):
            var date_prediction = source_prediction.data['date'];
            var total_cases_prediction = source_prediction.data['75%'];
 
-           const new_cases_no_Nan = new_cases.filter(function (value) {
+           const new_cases_no_Nan = Array.from(new_cases).filter(function (value) {
                return !Number.isNaN(value);
            });
-           const cases_no_Nan = total_cases.filter(function (value) {
+           const cases_no_Nan = Array.from(total_cases).filter(function (value) {
                return !Number.isNaN(value);
            });
 
@@ -490,18 +761,17 @@ def generate_plot(data, df_all_prediction):
            button_click_count.data.clicks ++
            var show_prediction = (button_click_count.data.clicks % 2) == 1
 
-           var locations_predicted = source_all_prediction.data['location'].filter(unique)
-
            if (locations_predicted.includes(country) == false){
                window.alert("This country doesn't have prediction: Available countries are: " + locations_predicted);
            }
            else{
+               const y_range_right_values = new_cases_no_Nan.concat(Array.from(total_deaths))
+
                if (show_prediction == true){
                    median_prediction.visible = true
                    band_low.visible = true
                    band_high.visible = true
                    prediction_cases_line.visble = true
-                   const y_range_right_values = [].concat([].slice.call(new_cases_no_Nan), [].slice.call(total_deaths))
 
                    y_range_left.setv({"start": -0.05*Math.max.apply(Math, total_cases_prediction), "end": 1.1 * Math.max.apply(Math, total_cases_prediction)})
                    y_range_right.setv({"start": -0.05*Math.max.apply(Math, y_range_right_values) * Math.max.apply(Math, total_cases_prediction) / Math.max.apply(Math, cases_no_Nan),
@@ -514,7 +784,6 @@ def generate_plot(data, df_all_prediction):
                    band_low.visible = false
                    band_high.visible = false
                    prediction_cases_line.visble = false
-                   const y_range_right_values = [].concat([].slice.call(new_cases_no_Nan), [].slice.call(total_deaths))
 
                    y_range_left.setv({"start": -0.05*Math.max.apply(Math, cases_no_Nan), "end": 1.1*Math.max.apply(Math, cases_no_Nan)})
                    y_range_right.setv({"start": -0.05*Math.max.apply(Math, y_range_right_values), "end": 1.1*Math.max.apply(Math, y_range_right_values)})
@@ -531,91 +800,30 @@ def generate_plot(data, df_all_prediction):
 
     callback_slider = bkm.CustomJS(
         args=dict(
-            source=source,
             source_prediction=source_prediction,
-            source_all_prediction=source_all_prediction,
+            prediction_windows=prediction_windows,
+            prediction_columns=prediction_columns,
             source_prediction_end_date=source_prediction_end_date,
-            select=select,
-            prediction_cases_line=prediction_cases_line,
             slider=slider,
             button_click_count=button_click_count,
-            x_range=p.x_range,
-            y_range_left=p.y_range,
-            y_range_right=p.extra_y_ranges["Number of deaths"],
         ),
         code="""
-
-                           // function to get unique value of an array
-                           const unique = (value, index, self) => {
-                               return self.indexOf(value) === index
-                           }
-
-                           var slider_value = slider.value
-                           var country = select.value
-
-                           var date_prediction = source_prediction.data['date']
-                           var date_str = source_prediction.data['date_str']
-                           var date_end_prediction = source_prediction.data['date_end_train']
-                           var quantile_1 = source_prediction.data['25%'];
-                           var quantile_2 = source_prediction.data['median']
-                           var quantile_3 = source_prediction.data['75%']
-                           var new_cases = source_prediction.data['derivative'];
-                           var median_prediction = source_prediction.data['median_display']
-
-                           var unique_end_prediction = date_end_prediction.filter(unique)
-
                            var show_prediction = (button_click_count.data.clicks % 2) == 1
-                           var locations_predicted = source_all_prediction.data['location'].filter(unique)
-
-                           if (show_prediction == true && locations_predicted.includes(country)){
-                                var new_date_prediction = []
-                                var new_date_str = []
-                                var new_date_end_prediction = []
-                                var new_quantile_1 = []
-                                var new_quantile_2 = []
-                                var new_quantile_3 = []
-                                var new_new_cases = []
-                                var new_median_prediction = []
-
-                                for(var i=0; i < quantile_1.length; i++){
-                                    if(date_end_prediction[i]==unique_end_prediction[slider.end - slider_value]){
-                                        new_date_prediction.push(date_prediction[i])
-                                        new_date_str.push(date_str[i])
-                                        new_date_end_prediction.push(date_end_prediction[i])
-                                        new_quantile_1.push(quantile_1[i]);
-                                        new_quantile_2.push(quantile_2[i]);
-                                        new_quantile_3.push(quantile_3[i]);
-                                        new_new_cases.push(new_cases[i]);
-                                        new_median_prediction.push(median_prediction[i]);
-                                    }
-                                }   
-
-
-                                source_prediction_end_date.data['date']=new_date_prediction
-                                source_prediction_end_date.data['date_str']=new_date_str
-                                source_prediction_end_date.data['date_end_train']=new_date_end_prediction
-                                source_prediction_end_date.data['25%']=new_quantile_1;
-                                source_prediction_end_date.data['median']=new_quantile_2;
-                                source_prediction_end_date.data['75%']=new_quantile_3;
-                                source_prediction_end_date.data['derivative']=new_new_cases;
-                                source_prediction_end_date.data['median_display']=new_median_prediction;
-
-                                source_prediction_end_date.change.emit();
-
-                                var date_prediction = source_prediction_end_date.data['date'];
-                                var total_cases_prediction = source_prediction_end_date.data['75%'];
+                           const windows = prediction_windows.data['offsets']
 
-                                const new_cases_no_Nan = new_cases.filter(function (value) {
-                                    return !Number.isNaN(value);
-                                 });
-                                const cases_no_Nan = quantile_2.filter(function (value) {
-                                   return !Number.isNaN(value);
-                                 });
+                           if (show_prediction == true && windows.length > 1){
+                                // the slider value is the number of days dropped from the last window,
+                                // windows are the offsets of the country windows in source_prediction
 
+                                const window_index = windows.length - 2 - slider.value
+                                const start = windows[window_index]
+                                const stop = windows[window_index + 1]
 
-                                // y_range_left.setv({"start": -0.05*Math.max.apply(Math, total_cases_prediction), "end": 1.1*Math.max.apply(Math, total_cases_prediction)})
-                                // x_range.setv({"start": Math.min.apply(Math, date_prediction), "end": 1.0001*Math.max.apply(Math, date_prediction)})
+                                for (const column of prediction_columns){
+                                    source_prediction_end_date.data[column] = source_prediction.data[column].slice(start, stop)
+                                }
 
+                                source_prediction_end_date.change.emit();
                            }
 
                                    """,
@@ -623,7 +831,4 @@ def generate_plot(data, df_all_prediction):
 
     slider.js_on_change("value", callback_slider)
 
-    p.legend.location = "top_left"
-    p.legend.click_policy = "mute"
-
     return select, button_prediction, slider, p
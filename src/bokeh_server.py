@@ -0,0 +1,283 @@
+import argparse
+import logging
+from functools import lru_cache, partial
+from pathlib import Path
+
+import bokeh.models as bkm
+import numpy as np
+import pandas as pd
+from bokeh.server.server import Server
+
+from src.bokeh_plot import (
+    COMPACT_DATA_DTYPES,
+    COMPACT_PREDICTION_DTYPES,
+    covid_figure,
+    read_prediction_shard,
+    shard_name,
+)
+from src.store import CaseStore
+from src.utils import CHINA_SMOOTHING, data_china_smoothing
+
+logger = logging.getLogger(__name__)
+
+
+class CountryPayloads:
+    """
+    In-process LRU cache of the ColumnDataSource payloads of each country, shared by
+    all the sessions of the server. The payload of a country holds its observed data
+    read from a CaseStore and its predictions read from its shard, it is read again
+    once the store or the shard of the country is updated. The smoothed locations
+    of the daily update, ex: "China Smooth", are computed from their stored location
+    with the same correction.
+
+    Parameters
+    ----------
+    store: CaseStore of the observed data
+    shards_path: folder of the predictions shards written with write_prediction_shard
+    max_size: maximum number of countries kept in memory, default=64
+    """
+
+    # --- locations computed by data_china_smoothing from a stored location --- #
+    smoothed_locations = {"China Smooth": "China"}
+
+    def __init__(self, store: CaseStore, shards_path, max_size=64):
+        self.store = store
+        self.shards_path = Path(shards_path)
+        self.max_size = max_size
+        self._cached_load = lru_cache(maxsize=max_size)(self._load)
+
+    def get(self, location: str):
+        """
+        return the payload of location, a dictionary with the columns of the observed
+        data, the columns of the predictions, None without shard, and the offsets of
+        the training windows in the predictions
+        """
+        return self._cached_load(location, self._version(location))
+
+    def locations(self):
+        """return the stored locations and the smoothed locations computed from them"""
+        stored = self.store.locations()
+        return sorted(
+            stored
+            + [
+                location
+                for location, source in self.smoothed_locations.items()
+                if source in stored
+            ]
+        )
+
+    def cache_info(self):
+        """return the hits, misses and size of the cache"""
+        return self._cached_load.cache_info()
+
+    def _version(self, location: str):
+        """last stored date and shard modification time of location"""
+        shard = self.shards_path / shard_name(location)
+        return (
+            self.store.max_date(self.smoothed_locations.get(location, location)),
+            shard.stat().st_mtime_ns if shard.exists() else None,
+        )
+
+    def _load(self, location: str, version):
+        """read the observed data and the predictions of location"""
+        source = self.smoothed_locations.get(location, location)
+        data = self.store.read_location(source)
+        if source != location:
+            data = data_china_smoothing(data, **CHINA_SMOOTHING)
+        columns = {
+            column: data[column].to_numpy(copy=True) for column in COMPACT_DATA_DTYPES
+        }
+
+        shard = read_prediction_shard(self.shards_path, location)
+        predictions, windows = (None, [0]) if shard is None else shard
+
+        return {"data": columns, "predictions": predictions, "windows": windows}
+
+
+def window_columns(payload, days_dropped=0):
+    """
+    return the predictions of the training window ending days_dropped windows before
+    the last one, empty columns if the country has no predictions
+    """
+    windows = payload["windows"]
+    if payload["predictions"] is None or len(windows) < 2:
+        return {column: np.empty(0) for column in COMPACT_PREDICTION_DTYPES}
+
+    window_index = max(len(windows) - 2 - days_dropped, 0)
+    start, stop = windows[window_index], windows[window_index + 1]
+
+    return {
+        column: values[start:stop] for column, values in payload["predictions"].items()
+    }
+
+
+def _set_ranges(p, data, predictions=None):
+    """fit the ranges of p to the observed data, and to the predictions if given"""
+    max_cases = np.nanmax(data["total_cases"])
+    max_right = np.nanmax(np.concatenate([data["new_cases"], data["total_deaths"]]))
+    dates = data["date"]
+
+    if predictions is not None and len(predictions["date"]) > 0:
+        # --- the right axis keeps its ratio to the left axis --- #
+        max_prediction = np.nanmax(predictions["75%"])
+        max_right *= max_prediction / max_cases
+        max_cases = max_prediction
+        dates = predictions["date"]
+
+    p.y_range.update(start=-0.05 * max_cases, end=1.1 * max_cases)
+    p.extra_y_ranges["Number of deaths"].update(
+        start=-0.05 * max_right, end=1.1 * max_right
+    )
+    p.x_range.update(
+        start=pd.Timestamp(np.min(dates)),
+        end=pd.Timestamp(np.max(dates)) + pd.Timedelta(days=1),
+    )
+
+
+def make_document(doc, payloads: CountryPayloads, locations=None, country="World"):
+    """
+    Add the covid 19 plot to a session document of the server, with the select,
+    prediction button and slider of generate_plot answered by python callbacks
+    sending only the data of the selected country and training window
+
+    Parameters
+    ----------
+    doc: bokeh Document of the session
+    payloads: CountryPayloads shared by the sessions
+    locations: locations of the select, all the locations of payloads if None
+    country: initially displayed country, default="World"
+    """
+    if locations is None:
+        locations = payloads.locations()
+    if country not in locations:
+        country = locations[0]
+
+    payload = payloads.get(country)
+    n_windows = max(len(payload["windows"]) - 1, 1)
+
+    source = bkm.ColumnDataSource(payload["data"])
+    source_prediction_end_date = bkm.ColumnDataSource(window_columns(payload))
+
+    p, prediction_renderers = covid_figure(
+        source,
+        source_prediction_end_date,
+        pd.DataFrame(payload["data"]),
+        country,
+        compact=True,
+    )
+
+    select = bkm.Select(title="Country: ", value=country, options=list(locations))
+    button_prediction = bkm.Button(label="Show predictions", button_type="primary")
+    slider = bkm.Slider(
+        start=0,
+        end=max(n_windows - 1, 1),
+        value=0,
+        step=1,
+        title="Days dropped for prediction",
+    )
+
+    # --- whether or not the predictions of the session are displayed --- #
+    state = {"show_prediction": False}
+
+    def show_predictions(show):
+        state["show_prediction"] = show
+        for renderer in prediction_renderers:
+            renderer.visible = show
+
+        # --- the window of the slider is sent once the predictions are shown --- #
+        payload = payloads.get(select.value)
+        predictions = None
+        if show:
+            predictions = window_columns(payload, slider.value)
+            source_prediction_end_date.data = predictions
+
+        _set_ranges(p, payload["data"], predictions)
+
+    def on_country(attr, old, new):
+        payload = payloads.get(new)
+        n_windows = max(len(payload["windows"]) - 1, 1)
+
+        source.data = payload["data"]
+        p.title.text = "Evolution du nombre de cas en " + new
+        show_predictions(False)
+        slider.update(end=max(n_windows - 1, 1), value=0)
+
+    def on_window(attr, old, new):
+        if state["show_prediction"]:
+            source_prediction_end_date.data = window_columns(
+                payloads.get(select.value), new
+            )
+
+    def on_button():
+        payload = payloads.get(select.value)
+        if payload["predictions"] is None:
+            p.title.text = "This country doesn't have prediction: " + select.value
+            return
+
+        show_predictions(not state["show_prediction"])
+
+    select.on_change("value", on_country)
+    slider.on_change("value", on_window)
+    button_prediction.on_click(on_button)
+
+    doc.add_root(
+        bkm.Column(
+            bkm.Row(select, button_prediction, slider, sizing_mode="stretch_width"),
+            p,
+            sizing_mode="stretch_both",
+        )
+    )
+    doc.title = "Covid 19 evolution"
+
+
+def serve(data_path, shards_path, port=5006, max_size=64, allow_websocket_origin=None):
+    """
+    Run a bokeh server of the covid 19 plot reading a local data folder
+
+    Parameters
+    ----------
+    data_path: folder holding the CaseStore written by generate_plot_html in store/
+    shards_path: folder of the predictions shards
+    port: port of the server, default=5006
+    max_size: maximum number of countries kept in the cache, default=64
+    allow_websocket_origin: list of hosts allowed to connect, default=localhost
+    """
+    payloads = CountryPayloads(
+        CaseStore(Path(data_path) / "store"), shards_path, max_size
+    )
+
+    server = Server(
+        {"/": partial(make_document, payloads=payloads)},
+        port=port,
+        allow_websocket_origin=allow_websocket_origin,
+    )
+    server.start()
+    logger.info(f"covid 19 plot served on http://localhost:{port}/")
+    server.io_loop.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the covid 19 plot from a local data folder"
+    )
+    parser.add_argument("--data-path", type=Path, default=Path("data"))
+    parser.add_argument(
+        "--shards-path", type=Path, default=Path("assets") / "predictions"
+    )
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--max-size", type=int, default=64)
+    parser.add_argument("--allow-websocket-origin", action="append", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve(
+        args.data_path,
+        args.shards_path,
+        args.port,
+        args.max_size,
+        args.allow_websocket_origin,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+from src.files import atomic_write
+from src.pipeline import code_fingerprint
+
+
+@lru_cache(maxsize=None)
+def _model_fingerprint(model_class):
+    """sha256 of the source of the classes of model_class and of utils.FIT_CODE"""
+    classes = [
+        cls for cls in model_class.__mro__ if cls.__module__ == model_class.__module__
+    ]
+    return code_fingerprint([*classes, *utils.FIT_CODE])
+
+
+class FitCache:
+    """
+    Content addressed on-disk cache of SigmoidModel.fit results. A fit is identified
+    by the hash of its training data, of the model parameters changing the fit, of
+    the parameters it was warm started from and of the source of the model classes
+    and of the fitting functions listed in utils.FIT_CODE, so that editing the rest
+    of utils keeps the cached fits. The least recently used fits are evicted by evict
+    once the cache exceeds max_size.
+
+    Parameters
+    ----------
+    directory : folder where the fitted parameters are stored
+    max_size : maximum size of the cache in bytes, default=100MB
+    """
+
+    key_params = [
+        "n_bootstrap",
+        "loss",
+        "linear_proba",
+        "solver",
+        "bootstrap",
+        "warm_start_tol",
+        "n_starts",
+        "max_iter",
+        "screen_iter",
+        "tol",
+    ]
+
+    def __init__(self, directory, max_size=100 * 2**20):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def key(self, X: pd.DataFrame, model, init_params=None) -> str:
+        """
+        Compute the key of a fit
+
+        Parameters
+        ----------
+        X : pd.DataFrame containing the values to fit
+        model : SigmoidModel or TwoModeGrowthModel to fit
+        init_params : parameters the fit is warm started from, default=None
+
+        Returns
+        -------
+        hexadecimal sha256 of the training data, model parameters, initial
+        parameters and code of the fit
+        """
+        digest = hashlib.sha256()
+        digest.update(
+            pd.util.hash_pandas_object(
+                X.loc[:, ["date", "total_cases"]], index=False
+            ).values.tobytes()
+        )
+        digest.update(type(model).__name__.encode())
+        for param in self.key_params:
+            digest.update(f"{param}={getattr(model, param, None)!r};".encode())
+        digest.update(_model_fingerprint(type(model)).encode())
+
+        # --- a warm started fit depends on the parameters it starts from --- #
+        if init_params is not None:
+            for name in sorted(init_params):
+                digest.update(name.encode())
+                digest.update(np.asarray(init_params[name], dtype=float).tobytes())
+
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    # --- name of the convergence flags stored next to the parameters of a fit --- #
+    success_name = "_success"
+
+    def get(self, key: str):
+        """
+        Return the parameters stored under key and whether each bootstrap sample
+        converged, None if it was not stored, and mark them as recently used, None
+        if the fit is not in the cache
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                params = {
+                    name: stored[name].tolist()
+                    for name in stored.files
+                    if name != self.success_name
+                }
+                success = None
+                if self.success_name in stored.files:
+                    success = stored[self.success_name].tolist()
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+        return params, success
+
+    def set(self, key: str, params: dict, success=None, evict=False):
+        """
+        Store the parameters of a fit under key with whether each bootstrap sample
+        converged, if given, the least recently used fits are evicted if evict is
+        True, otherwise by a call to evict once a batch of fits is stored
+        """
+        arrays = {name: np.asarray(values) for name, values in params.items()}
+        if success is not None:
+            arrays[self.success_name] = np.asarray(success, dtype=bool)
+
+        with atomic_write(self._path(key), "wb") as f:
+            np.savez(f, **arrays)
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used fits until the cache fits in max_size"""
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
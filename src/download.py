@@ -0,0 +1,310 @@
+import email.utils
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from src.files import atomic_write
+
+OWID_URL = "https://covid.ourworldindata.org/data/owid-covid-data.csv"
+
+
+def _meta_path(path: Path) -> Path:
+    return path.with_name(path.name + ".meta.json")
+
+
+def _part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+
+def _read_json(path: Path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path: Path, values: dict):
+    with atomic_write(path) as f:
+        json.dump(values, f)
+
+
+def open_dataset(path):
+    """
+    Open a file written by download_dataset for reading, decompressing it on the fly
+    if it was sent compressed, so that it is parsed without a decompressed copy
+
+    Parameters
+    ----------
+    path: path of the downloaded file
+
+    Returns
+    -------
+    binary file object of the decoded content
+    """
+    path = Path(path)
+    meta = _read_json(_meta_path(path)) or {}
+
+    if meta.get("encoding") == "gzip":
+        return gzip.open(path, "rb")
+
+    return open(path, "rb")
+
+
+def content_hash(path, chunk_size=2**20):
+    """return the sha256 of the decoded content of a file written by download_dataset"""
+    digest = hashlib.sha256()
+    with open_dataset(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def download_dataset(url, path, retries=3, timeout=60, chunk_size=2**20):
+    """
+    Download url to path only if it changed since the previous download. The request
+    is conditional on the ETag and Last-Modified of the previous response, the body
+    is written to a .part file resumed with a range request after a failure and moved
+    into place once complete. The body is stored as sent, gzip compressed if the
+    server supports it, read it with open_dataset.
+
+    Parameters
+    ----------
+    url: url of the dataset
+    path: destination of the dataset, its response headers and content hash are
+        stored next to it in path.meta.json
+    retries: number of attempts resuming an interrupted download, default=3
+    timeout: timeout of each request in seconds, default=60
+    chunk_size: number of bytes read at once, default=1MB
+
+    Returns
+    -------
+    dictionary with the status "not_modified", "downloaded" or "resumed", the sha256
+    of the content, its encoding and the number of bytes received
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = _read_json(_meta_path(path)) if path.exists() else None
+
+    error = None
+    for _ in range(max(retries, 1)):
+        try:
+            result = _request(url, path, meta, timeout, chunk_size)
+            break
+        except (OSError, http.client.HTTPException) as exc:
+            # --- the .part file is kept and resumed by the next attempt --- #
+            error = exc
+    else:
+        raise error
+
+    if result["status"] == "not_modified":
+        return {**result, "sha256": meta.get("sha256")}
+
+    part = _part_path(path)
+    sha256 = content_hash(part)
+    with open(part, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(part, path)
+
+    new_meta = {
+        "url": url,
+        "etag": result.pop("etag"),
+        "last_modified": result.pop("last_modified"),
+        "encoding": result["encoding"],
+        "sha256": sha256,
+    }
+    _write_json(_meta_path(path), new_meta)
+    if _meta_path(part).exists():
+        os.remove(_meta_path(part))
+
+    return {**result, "sha256": sha256}
+
+
+def _request(url, path, meta, timeout, chunk_size):
+    """send a single conditional or range request and write its body to the .part file"""
+    part = _part_path(path)
+    part_meta = _read_json(_meta_path(part)) if part.exists() else None
+
+    headers = {"Accept-Encoding": "gzip"}
+    resume_from = 0
+    if part_meta is not None and (part_meta["etag"] or part_meta["last_modified"]):
+        # --- resume only if the resource did not change since the partial body --- #
+        resume_from = part.stat().st_size
+        headers["Range"] = f"bytes={resume_from}-"
+        headers["If-Range"] = part_meta["etag"] or part_meta["last_modified"]
+    elif meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as exc:
+        if exc.code == 304:
+            return {"status": "not_modified", "encoding": None, "n_bytes": 0}
+        if exc.code == 416:
+            # --- the partial body is not a prefix of the resource any more --- #
+            os.remove(part)
+            os.remove(_meta_path(part))
+        raise
+
+    with response:
+        resumed = response.status == 206
+        if resumed:
+            start = int(response.headers["Content-Range"].split()[1].split("-")[0])
+            if start != resume_from:
+                raise http.client.HTTPException(
+                    f"range starting at {start} instead of {resume_from}"
+                )
+        else:
+            _write_json(
+                _meta_path(part),
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "encoding": response.headers.get("Content-Encoding"),
+                },
+            )
+            part_meta = _read_json(_meta_path(part))
+
+        n_bytes = 0
+        with open(part, "ab" if resumed else "wb") as f:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                f.write(chunk)
+                n_bytes += len(chunk)
+
+        expected = response.headers.get("Content-Length")
+        if expected is not None and n_bytes != int(expected):
+            raise http.client.IncompleteRead(b"", int(expected) - n_bytes)
+
+    return {
+        "status": "resumed" if resumed else "downloaded",
+        "encoding": part_meta["encoding"],
+        "n_bytes": n_bytes,
+        "etag": part_meta["etag"],
+        "last_modified": part_meta["last_modified"],
+    }
+
+
+class LocalDatasetServer:
+    """
+    Local HTTP stand-in of the dataset server, serving a single file with ETag and
+    Last-Modified validators, range requests and gzip encoding, to run and test the
+    download without network access:
+
+        with LocalDatasetServer("owid-covid-data.csv") as server:
+            download_dataset(server.url, "data/ecdc_full_data.csv")
+
+    Parameters
+    ----------
+    path: file served at every url
+    gzip_encoding: whether or not to send the file gzip compressed to the clients
+        accepting it, default=True
+    fail_after: number of bytes of the body sent before closing the connection, to
+        simulate an interrupted download, default=None
+    port: port of the server, default=0 for any free port
+    """
+
+    def __init__(self, path, gzip_encoding=True, fail_after=None, port=0):
+        self.path = Path(path)
+        self.gzip_encoding = gzip_encoding
+        self.fail_after = fail_after
+        self.port = port
+        self.n_requests = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/{self.path.name}"
+
+    def representation(self, accept_gzip):
+        """return the body, its ETag and its encoding sent to a client"""
+        body = self.path.read_bytes()
+        encoding = None
+        if self.gzip_encoding and accept_gzip:
+            # --- mtime=0 so that the compressed body only depends on the file --- #
+            body = gzip.compress(body, mtime=0)
+            encoding = "gzip"
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+        return body, etag, encoding
+
+    def __enter__(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in.n_requests += 1
+                body, etag, encoding = stand_in.representation(
+                    "gzip" in self.headers.get("Accept-Encoding", "")
+                )
+                last_modified = email.utils.formatdate(
+                    stand_in.path.stat().st_mtime, usegmt=True
+                )
+
+                if self.headers.get("If-None-Match") == etag or (
+                    "If-None-Match" not in self.headers
+                    and self.headers.get("If-Modified-Since") == last_modified
+                ):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                start = 0
+                range_header = self.headers.get("Range")
+                if range_header and self.headers.get("If-Range") in (
+                    etag,
+                    last_modified,
+                ):
+                    start = int(range_header.split("=")[1].split("-")[0])
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+                    )
+                else:
+                    self.send_response(200)
+
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(len(body) - start))
+                if encoding is not None:
+                    self.send_header("Content-Encoding", encoding)
+                self.end_headers()
+
+                stop = len(body)
+                if stand_in.fail_after is not None:
+                    # --- close the connection once fail_after bytes were sent --- #
+                    stop = min(stop, start + stand_in.fail_after)
+                    stand_in.fail_after = None
+                self.wfile.write(body[start:stop])
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# --- permissions of a file created with open, mkstemp creates it readable by its --- #
+# --- owner only                                                                  --- #
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Open a temporary file next to path, moved onto path once the with block succeeds
+    so that readers never see a partial file and removed if the block fails. Each
+    writer has its own temporary file, concurrent writers of the same path never
+    write into each other's file and the last one to finish wins.
+
+    Parameters
+    ----------
+    path: destination of the file, its folder is created if needed
+    mode: "w" for text or "wb" for bytes, default="w"
+
+    Returns
+    -------
+    file object of the temporary file
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
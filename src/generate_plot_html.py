@@ -1,128 +1,595 @@
-import subprocess
+"""
+Daily update of the covid 19 plot
+
+Download the dataset, fit the predictions of every location and write the plot
+included in the site, from the root of the repository:
+
+    python -m src.generate_plot_html
+    python -m src.generate_plot_html --force --profile cprofile,tracemalloc
+    python -m src.generate_plot_html --skip-download --location France
+
+The stages are run by a Pipeline which skips the stages whose inputs, parameters
+and code did not change since their last run: a change of the plot only renders
+it again and an unchanged dataset stops after the download. They are also
+callable one by one from python, the plotting and fitting libraries being
+imported only by the stages using them.
+"""
+
+import argparse
+import logging
 import os
-from pathlib import Path
 import sys
-import logging
-from tqdm import tqdm
+from functools import partial
+from pathlib import Path
 
-import bokeh.models as bkm
-from bokeh.embed import file_html
-from bokeh.resources import Resources
+ROOT_PATH = Path(__file__).resolve().parent.parent
 
-sys.path.append(str(Path(os.getcwd()).parent))
-sys.path.append(os.getcwd())
+if not __package__:
+    # --- run as a script, the src package is imported from the repository --- #
+    sys.path.append(str(ROOT_PATH))
 
-from src.utils import *
-from src import bokeh_plot
+from src import instrument
+from src.download import OWID_URL, download_dataset, open_dataset
+from src.files import atomic_write
+from src.pipeline import Pipeline, Stage
 
-logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-data_path = Path("../data/")
-includes_path = Path("../_includes/")
-
-# ---- Update data ---- #
-if os.path.exists(str(data_path) + "/ecdc_full_data.csv"):
-    logger.info("Deleting file")
-    os.remove(str(data_path) + "/ecdc_full_data.csv")
-
-bashCommand = "wget https://covid.ourworldindata.org/data/owid-covid-data.csv"
-subprocess.call(bashCommand.split(), stdout=subprocess.PIPE)
-
-bashCommand = "mv owid-covid-data.csv " + str(data_path) + "/ecdc_full_data.csv"
-subprocess.call(bashCommand.split(), stdout=subprocess.PIPE)
-
-# ---- read data ---- #
-
-data = pd.read_csv(data_path / "ecdc_full_data.csv")
-data = (
-    data[
-        data.location.isin(
-            [
-                "World",
-                "France",
-                "China",
-                "United States",
-                "Sweden",
-                "Denmark",
-                "Italy",
-                "Spain",
-                "United Kingdom",
-                "Germany",
-            ]
-        )
-    ]
-    .loc[
-        :,
-        [
-            "date",
-            "location",
-            "new_cases_smoothed",
-            "total_cases",
-            "new_deaths_smoothed",
-            "total_deaths",
-        ],
-    ]
-    .rename(
-        columns={"new_cases_smoothed": "new_cases", "new_deaths_smoothed": "new_deaths"}
+
+def update_dataset(dataset_path, url=OWID_URL):
+    """
+    Download the dataset if it changed since the previous download, a failed
+    download keeps the previous dataset if there is one
+
+    Returns
+    -------
+    dictionary returned by download_dataset, with the status "failed" if the
+    download failed
+    """
+    dataset_path = Path(dataset_path)
+    with instrument.stage("download"):
+        try:
+            download = download_dataset(url, dataset_path)
+        except OSError:
+            if not dataset_path.exists():
+                raise
+            logger.exception("Download failed, keeping the previous dataset")
+            download = {"status": "failed", "n_bytes": 0}
+
+    logger.info(f"Dataset {download['status']}")
+    instrument.count("download.bytes", download["n_bytes"])
+
+    return download
+
+
+def ingest_dataset(dataset_path, store_path):
+    """
+    Add the new rows of the dataset to the CaseStore at store_path
+
+    Returns
+    -------
+    number of rows added
+    """
+    from src.store import CaseStore, ingest_owid_csv
+
+    with instrument.stage("parse_csv"):
+        # --- the csv is decompressed while it is parsed --- #
+        with open_dataset(dataset_path) as dataset:
+            n_rows = ingest_owid_csv(dataset, CaseStore(store_path))
+    logger.info(f"{n_rows} new rows stored")
+    instrument.count("rows.ingested", n_rows)
+
+    return n_rows
+
+
+def read_data(store_path):
+    """
+    Read all the data of the CaseStore at store_path, with the smoothed data of China
+    if China is stored
+
+    Returns
+    -------
+    pd.DataFrame of all locations
+    """
+    import pandas as pd
+
+    from src.store import CaseStore
+    from src.utils import CHINA_SMOOTHING, data_china_smoothing
+
+    store = CaseStore(store_path)
+    with instrument.stage("read_store"):
+        frames = {
+            location: store.read_location(location) for location in store.locations()
+        }
+
+    smoothed = []
+    if "China" in frames:
+        with instrument.stage("china_smoothing"):
+            smoothed.append(data_china_smoothing(frames["China"], **CHINA_SMOOTHING))
+
+    # --- the stored and smoothed rows are copied once into a single frame --- #
+    with instrument.stage("read_store"):
+        data = pd.concat([*frames.values(), *smoothed], ignore_index=True)
+
+    return data
+
+
+def iter_predictions(
+    data,
+    cache_path=None,
+    n_bootstrap=50,
+    n_windows=11,
+    n_days_prediction=300,
+    locations=None,
+):
+    """
+    Fit the moving windows of every location together and yield the predictions of
+    each location as soon as all its windows are fitted, the fits of the windows
+    which did not change since the previous run are read from the FitCache at
+    cache_path. A location whose fit fails is logged and left out.
+
+    Yields
+    ------
+    location, pd.DataFrame of its predictions, for all locations or for locations
+    if given
+    """
+    from src.cache import FitCache
+    from src.utils import LocationIndex, iter_panel_predictions, panel_country_kwargs
+
+    if locations is not None:
+        data = data[data.location.isin(locations)]
+
+    country_kwargs = panel_country_kwargs(
+        LocationIndex(data), n_windows=n_windows, n_days_prediction=n_days_prediction
     )
-    .dropna()
-)
-data.loc[:, ["new_cases", "new_deaths"]] = data.loc[
-    :, ["new_cases", "new_deaths"]
-].astype("int")
-data["date"] = data.date.apply(pd.to_datetime)
-data["date_str"] = data.date.apply(lambda x: x.strftime("%d/%m/%Y"))
-data = data_china_smoothing(data, n_days_smoothing=6, n_cases_true=5000)
-
-df_all_prediction = pd.DataFrame()
-countries = [
-    "World",
-]
-
-
-# ---- compute predictions data ---- #
-
-for country in tqdm(countries, position=0, leave=True):
-    logger.info(" fit model for " + country + " data")
-    df = get_country_and_min_count(data, country)
-
-    n_prediction = df.shape[0]
-
-    fitted_sigmoid_df, parameters_values_sigmoid = compute_moving_predictions(
-        df,
-        n_prediction=n_prediction + 300,
-        n_bootstrap=50,
-        min_data=df.shape[0] - 10,
+    if not country_kwargs:
+        raise ValueError(f"no location with enough data to fit among {locations}")
+    logger.info(f" fit model for {len(country_kwargs)} locations")
+    instrument.count("locations.fitted", len(country_kwargs))
+
+    # --- the windows of all locations are fitted together by the batched solver --- #
+    predictions = iter_panel_predictions(
+        country_kwargs,
+        n_bootstrap=n_bootstrap,
         step=1,
         loss="MSE",
         linear_proba=True,
+        random_state=0,
+        cache=None if cache_path is None else FitCache(cache_path),
     )
-    fitted_sigmoid_df["location"] = np.repeat(
-        country, repeats=fitted_sigmoid_df.shape[0]
+    while True:
+        # --- only the fit is timed, not the code consuming the predictions --- #
+        with instrument.stage("predictions"):
+            fitted = next(predictions, None)
+        if fitted is None:
+            return
+
+        location, df_prediction, _ = fitted
+        yield location, df_prediction
+
+
+def compute_predictions(
+    data,
+    cache_path=None,
+    n_bootstrap=50,
+    n_windows=11,
+    n_days_prediction=300,
+    locations=None,
+):
+    """
+    Fit the moving windows of every location together, see iter_predictions
+
+    Returns
+    -------
+    pd.DataFrame of the predictions of all locations, or of locations if given
+    """
+    import pandas as pd
+
+    return pd.concat(
+        [
+            df_prediction
+            for _, df_prediction in iter_predictions(
+                data, cache_path, n_bootstrap, n_windows, n_days_prediction, locations
+            )
+        ],
+        ignore_index=True,
     )
 
-    df_all_prediction = pd.concat([df_all_prediction, fitted_sigmoid_df])
 
+def write_shards(df_all_prediction, shards_path):
+    """
+    Write the predictions of each country to its shard
+
+    Returns
+    -------
+    dictionary of the shard file name of each country
+    """
+    from src import bokeh_plot
+
+    prediction_shards = {}
+    with instrument.stage("write_shards"):
+        for country, df_prediction in df_all_prediction.groupby("location", sort=False):
+            prediction_shards[country] = bokeh_plot.write_prediction_shard(
+                shards_path, country, df_prediction
+            )
+
+    return prediction_shards
+
+
+def render_plot(data, df_all_prediction, prediction_shards):
+    """
+    Render the plot of the site, the predictions of World are embedded and the
+    other countries are read from their shards
+
+    Returns
+    -------
+    html of the plot
+    """
+    import bokeh.models as bkm
+    from bokeh.embed import file_html
+    from bokeh.resources import Resources
+
+    from src import bokeh_plot
+    from src.utils import get_country
+
+    with instrument.stage("generate_plot"):
+        select, button_prediction, slider, p = bokeh_plot.generate_plot(
+            data,
+            get_country(df_all_prediction, "World"),
+            compact=True,
+            shard_url="{{ page.root-folder }}assets/predictions/",
+            prediction_shards=prediction_shards,
+        )
+
+        html = file_html(
+            bkm.Column(
+                bkm.Row(select, button_prediction, slider, sizing_mode="stretch_width"),
+                p,
+                sizing_mode="stretch_width",
+            ),
+            Resources(mode="cdn"),
+            "plot",
+        )
+
+    return html.replace("<!DOCTYPE html>", " ")
 
-# ---- plot data ---- #
 
-select, button_prediction, slider, p = bokeh_plot.generate_plot(data, df_all_prediction)
+def write_html(html, path):
+    """write html to path, replaced at once so that the site never reads a partial plot"""
+    with instrument.stage("write_html"):
+        with atomic_write(path) as f:
+            f.write(html)
+    instrument.count("html.bytes", len(html.encode()))
+
+
+def _write_frame(df, path):
+    """pickle df to path"""
+    with atomic_write(path, "wb") as f:
+        df.to_pickle(f)
+
+
+def _download_stage(dataset, url):
+    update_dataset(dataset, url)
+
+
+def _ingest_stage(dataset, store):
+    ingest_dataset(dataset, store)
+
+
+def _cases_stage(store, cases):
+    _write_frame(read_data(store), cases)
+
+
+def _prediction_path(predictions, location):
+    """file of the predictions of location in the folder predictions"""
+    from src.bokeh_plot import shard_name
+
+    return Path(predictions) / (Path(shard_name(location)).stem + ".pkl")
+
+
+def _predictions_stage(cases, predictions, cache_path, n_bootstrap, locations=None):
+    """
+    fit the predictions, only the ones of locations if given, the predictions of each
+    location being written to its own file as soon as they are fitted
+    """
+    import pandas as pd
+
+    predictions = Path(predictions)
+    predictions.mkdir(parents=True, exist_ok=True)
+
+    written = set()
+    for location, df_prediction in iter_predictions(
+        pd.read_pickle(cases), cache_path, n_bootstrap=n_bootstrap, locations=locations
+    ):
+        path = _prediction_path(predictions, location)
+        _write_frame(df_prediction, path)
+        written.add(path)
+
+    # --- the predictions of the other locations are kept by a partial run, --- #
+    # --- the ones of the locations left out are removed                    --- #
+    if locations is None:
+        refitted = set(predictions.glob("*.pkl"))
+    else:
+        refitted = {_prediction_path(predictions, location) for location in locations}
+    for path in refitted - written:
+        path.unlink(missing_ok=True)
+
+
+def _shards_stage(predictions, shards, locations=None):
+    """write the shards of every location, only the ones of locations if given"""
+    import pandas as pd
+
+    if locations is None:
+        paths = sorted(Path(predictions).glob("*.pkl"))
+    else:
+        paths = [_prediction_path(predictions, location) for location in locations]
+
+    # --- the predictions are read one location at a time --- #
+    for path in paths:
+        if path.exists():
+            write_shards(pd.read_pickle(path), shards)
+
+
+def _render_stage(cases, predictions, plot):
+    import pandas as pd
+
+    from src.bokeh_plot import PREDICTION_COLUMNS, shard_name
+
+    data = pd.read_pickle(cases)
+    prediction_shards = {
+        location: shard_name(location)
+        for location in data.location.unique()
+        if _prediction_path(predictions, location).exists()
+    }
+
+    # --- the plot is rendered without predictions if the fit of World failed --- #
+    world_path = _prediction_path(predictions, "World")
+    if world_path.exists():
+        df_world_prediction = pd.read_pickle(world_path)
+    else:
+        df_world_prediction = pd.DataFrame(columns=PREDICTION_COLUMNS + ["location"])
+
+    html = render_plot(data, df_world_prediction, prediction_shards)
+    write_html(html, plot)
+
+
+# --- names of the stages of the daily update, in order --- #
+STAGES = ["download", "ingest", "cases", "predictions", "shards", "render"]
+
+
+def build_pipeline(
+    data_path,
+    includes_path,
+    shards_path,
+    url=OWID_URL,
+    skip_download=False,
+    n_bootstrap=50,
+):
+    """
+    Declare the stages of the daily update with their artifacts. The intermediate
+    data and predictions are pickled in data_path/artifacts so that a stage can
+    run without the stages upstream of it, the predictions of each location in
+    its own file written as soon as it is fitted.
+
+    Parameters
+    ----------
+    data_path: folder of the dataset, the CaseStore, the FitCache, the intermediate
+        artifacts and the state of the pipeline
+    includes_path: folder where plot.html is written
+    shards_path: folder of the predictions shards
+    url: url of the dataset, default=OWID_URL
+    skip_download: whether or not to leave out the download, the previously
+        downloaded dataset is then an input of the pipeline, default=False
+    n_bootstrap: number of bootstrap samples of each fit, default=50
+
+    Returns
+    -------
+    Pipeline
+    """
+    from src import bokeh_plot, cache, kernels, loader, store, utils
+
+    data_path = Path(data_path)
+    artifacts = {
+        "dataset": data_path / "ecdc_full_data.csv",
+        "store": data_path / "store",
+        "cases": data_path / "artifacts" / "cases.pkl",
+        "predictions": data_path / "artifacts" / "predictions",
+        "shards": Path(shards_path),
+        "plot": Path(includes_path) / "plot.html",
+    }
+
+    # --- the code of a stage is the source its outputs depend on, a change of --- #
+    # --- the figure in bokeh_plot only renders the plot again                 --- #
+    stages = [
+        Stage(
+            "download",
+            _download_stage,
+            outputs=["dataset"],
+            params={"url": url},
+            always=True,
+        ),
+        Stage(
+            "ingest",
+            _ingest_stage,
+            inputs=["dataset"],
+            outputs=["store"],
+            code=[ingest_dataset, store, loader],
+        ),
+        Stage(
+            "cases",
+            _cases_stage,
+            inputs=["store"],
+            outputs=["cases"],
+            code=[
+                read_data,
+                utils.correct_discontinuities,
+                utils.data_china_smoothing,
+                utils.CHINA_SMOOTHING,
+                store.CaseStore.locations,
+                store.CaseStore.read_location,
+            ],
+        ),
+        Stage(
+            "predictions",
+            partial(_predictions_stage, cache_path=data_path / "fit_cache"),
+            inputs=["cases"],
+            outputs=["predictions"],
+            params={"n_bootstrap": n_bootstrap},
+            code=[
+                _predictions_stage,
+                _prediction_path,
+                iter_predictions,
+                utils,
+                kernels,
+                cache,
+            ],
+        ),
+        Stage(
+            "shards",
+            _shards_stage,
+            inputs=["predictions"],
+            outputs=["shards"],
+            code=[
+                _shards_stage,
+                _prediction_path,
+                write_shards,
+                bokeh_plot.write_prediction_shard,
+                bokeh_plot.compact_columns,
+                bokeh_plot.shard_name,
+                bokeh_plot.COMPACT_PREDICTION_DTYPES,
+            ],
+        ),
+        Stage(
+            "render",
+            _render_stage,
+            inputs=["cases", "predictions"],
+            outputs=["plot"],
+            code=[_render_stage, _prediction_path, render_plot, write_html, bokeh_plot],
+        ),
+    ]
+    if skip_download:
+        stages = stages[1:]
+
+    return Pipeline(artifacts, stages, data_path / "pipeline_state.json")
+
+
+def run(
+    data_path,
+    includes_path,
+    shards_path,
+    url=OWID_URL,
+    force=False,
+    skip_download=False,
+    n_bootstrap=50,
+    stages=None,
+    locations=None,
+):
+    """
+    Run the stages of the daily update whose inputs, parameters or code changed
+    since their last run
+
+    Parameters
+    ----------
+    data_path: folder of the dataset, the CaseStore and the FitCache
+    includes_path: folder where plot.html is written
+    shards_path: folder of the predictions shards
+    url: url of the dataset, default=OWID_URL
+    force: whether or not to run every stage even if it is up to date,
+        default=False
+    skip_download: whether or not to use the previously downloaded dataset,
+        default=False
+    n_bootstrap: number of bootstrap samples of each fit, default=50
+    stages: names of STAGES to bring up to date with the stages upstream of them,
+        default=None for all the stages
+    locations: locations whose predictions and shards are computed again, the
+        other locations keep their predictions, default=None
+
+    Returns
+    -------
+    dictionary {stage name: "ran" or "skipped"}
+    """
+    pipeline = build_pipeline(
+        data_path, includes_path, shards_path, url, skip_download, n_bootstrap
+    )
+
+    options = {}
+    if locations is not None:
+        options = {
+            "predictions": {"locations": list(locations)},
+            "shards": {"locations": list(locations)},
+        }
+
+    return pipeline.run(targets=stages, force=STAGES if force else (), options=options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--data-path", type=Path, default=ROOT_PATH / "data")
+    parser.add_argument("--includes-path", type=Path, default=ROOT_PATH / "_includes")
+    parser.add_argument(
+        "--shards-path", type=Path, default=ROOT_PATH / "assets" / "predictions"
+    )
+    parser.add_argument("--url", default=os.environ.get("OWID_URL", OWID_URL))
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=bool(os.environ.get("FORCE_RUN")),
+        help="run every stage even if it is up to date",
+    )
+    parser.add_argument(
+        "--skip-download",
+        action="store_true",
+        help="use the previously downloaded dataset",
+    )
+    parser.add_argument("--n-bootstrap", type=int, default=50)
+    parser.add_argument(
+        "--stage",
+        action="append",
+        choices=STAGES,
+        default=None,
+        help="bring only this stage and the stages upstream of it up to date",
+    )
+    parser.add_argument(
+        "--location",
+        action="append",
+        default=None,
+        help="fit again and write the shard of this location only",
+    )
+    parser.add_argument(
+        "--profile",
+        default=os.environ.get("RUN_PROFILE", ""),
+        help="cprofile and/or tracemalloc, separated by a comma",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    profile = args.profile.split(",")
+    report = instrument.RunReport(
+        profile="cprofile" in profile, trace_memory="tracemalloc" in profile
+    )
+    report_path = args.data_path / "run_report.json"
 
-html = file_html(
-    bkm.Column(
-        bkm.Row(select, button_prediction, slider, sizing_mode="stretch_width"),
-        p,
-        sizing_mode="stretch_width",
-    ),
-    Resources(mode="cdn"),
-    "plot",
-)
+    # ---- every stage is timed in the run report, written even if the run fails ---- #
+    try:
+        with report:
+            run(
+                args.data_path,
+                args.includes_path,
+                args.shards_path,
+                url=args.url,
+                force=args.force,
+                skip_download=args.skip_download,
+                n_bootstrap=args.n_bootstrap,
+                stages=args.stage,
+                locations=args.location,
+            )
+    finally:
+        report.write(report_path)
+        logger.info(f"run report written to {report_path}")
 
-html = html.replace("<!DOCTYPE html>", " ")
+    return 0
 
-with open("plot.html", "w") as f:
-    f.write(html)
 
-bashCommand = "mv plot.html " + str(includes_path) + "/plot.html"
-subprocess.call(bashCommand.split(), stdout=subprocess.PIPE)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import cProfile
+import datetime
+import io
+import json
+import platform
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from src.files import atomic_write
+
+# --- report receiving the measures of stage, count and record, None when no --- #
+# --- report is active so that instrumented code costs nothing outside a run  --- #
+_active_report = None
+
+
+class RunReport:
+    """
+    Named timers and counters of a run of the pipeline, written as a JSON report.
+    While the report is active (inside its with block) the module functions stage,
+    count and record add their measures to it. Fits run in worker processes are
+    not recorded.
+
+    Parameters
+    ----------
+    profile : whether or not to run cProfile during the run and keep the functions
+        with the largest cumulative time in the report, default=False
+    trace_memory : whether or not to trace the python allocations with tracemalloc
+        and report the peak memory of each stage, default=False
+    n_functions : number of functions of the cProfile summary, default=30
+    """
+
+    def __init__(self, profile=False, trace_memory=False, n_functions=30):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.n_functions = n_functions
+        self.stages = {}
+        self.counters = {}
+        self.records = {}
+        self.started_at = None
+        self.wall_time_s = 0.0
+        self.profile_stats = None
+        self._profiler = None
+        self._start = None
+        self._previous_report = None
+
+    def __enter__(self):
+        global _active_report
+        self._previous_report = _active_report
+        _active_report = self
+
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_report
+        _active_report = self._previous_report
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile_stats = _profile_summary(self._profiler, self.n_functions)
+            self._profiler = None
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.wall_time_s = time.perf_counter() - self._start
+
+    @contextmanager
+    def stage(self, name: str):
+        """time the code of the with block under name, repeated stages are summed"""
+        stage = self.stages.setdefault(
+            name, {"calls": 0, "wall_time_s": 0.0, "errors": 0}
+        )
+        if self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            # --- python < 3.9 reports the peak since the start of the run --- #
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            stage["errors"] += 1
+            raise
+        finally:
+            stage["calls"] += 1
+            stage["wall_time_s"] += time.perf_counter() - start
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                stage["peak_traced_mb"] = max(stage.get("peak_traced_mb", 0.0), peak)
+
+    def count(self, name: str, value=1):
+        """add value to the counter name"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name: str, **values):
+        """append the measures of an event, ex: the statistics of a single fit"""
+        self.records.setdefault(name, []).append(values)
+
+    def to_dict(self):
+        """return the report as a dictionary of JSON serializable values"""
+        return {
+            "started_at": self.started_at,
+            "wall_time_s": self.wall_time_s,
+            "python": platform.python_version(),
+            "stages": self.stages,
+            "counters": self.counters,
+            "records": self.records,
+            "profile": self.profile_stats,
+        }
+
+    def write(self, path):
+        """write the report as JSON to path"""
+        with atomic_write(path) as f:
+            json.dump(self.to_dict(), f, indent=2, default=_json_default)
+
+
+def _profile_summary(profiler, n_functions):
+    """return the n_functions functions with the largest cumulative time"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for key, (_, n_calls, total, cumulative, _) in stats.stats.items():
+        filename, line, function = key
+        rows.append(
+            {
+                "function": f"{filename}:{line}({function})",
+                "calls": n_calls,
+                "total_time_s": total,
+                "cumulative_time_s": cumulative,
+            }
+        )
+
+    rows.sort(key=lambda row: row["cumulative_time_s"], reverse=True)
+
+    return rows[:n_functions]
+
+
+def _json_default(value):
+    """convert numpy scalars to python values"""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+@contextmanager
+def stage(name: str):
+    """time the with block under name in the active report, if any"""
+    if _active_report is None:
+        yield
+    else:
+        with _active_report.stage(name):
+            yield
+
+
+def count(name: str, value=1):
+    """add value to the counter name of the active report, if any"""
+    if _active_report is not None:
+        _active_report.count(name, value)
+
+
+def record(name: str, **values):
+    """append the measures of an event to the active report, if any"""
+    if _active_report is not None:
+        _active_report.record(name, **values)
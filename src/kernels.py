@@ -0,0 +1,161 @@
+import importlib.util
+import math
+
+import numpy as np
+
+# --- name of the backend evaluating the losses, "numba" when it is installed --- #
+BACKEND = "numpy" if importlib.util.find_spec("numba") is None else "numba"
+
+
+def _sigmoid_loss_kernel(t, values, weight, x0, K, r, mad=False):
+    """weighted MSE or MAD of the sigmoid computed in a single pass over the days"""
+    total = 0.0
+    for i in range(t.shape[0]):
+        residual = values[i] - K / (1.0 + math.exp(-r * (t[i] - x0)))
+        if mad:
+            total += weight[i] * abs(residual)
+        else:
+            total += weight[i] * residual * residual
+
+    return total
+
+
+def _sigmoid_loss_numpy(t, values, weight, x0, K, r, mad=False):
+    residual = values - K / (1 + np.exp(-r * (t - x0)))
+    return np.dot(weight, np.abs(residual) if mad else residual**2)
+
+
+def _containment_growth_values_kernel(t, params):
+    """containment_growth of each row of params on its row of t, in a single pass"""
+    n_batch, n_days = params.shape[0], t.shape[1]
+    values = np.empty((n_batch, n_days))
+    for b in range(n_batch):
+        x0, K, r1, r2, t1 = (
+            params[b, 0],
+            params[b, 1],
+            params[b, 2],
+            params[b, 3],
+            params[b, 4],
+        )
+        row = b if t.shape[0] > 1 else 0
+        # --- terms that do not depend on the day are computed once --- #
+        exp_t1 = math.exp(r1 * t1)
+        sigmoid_t1 = 0.5 * (1.0 + math.tanh(0.5 * r2 * (t1 - x0)))
+        for i in range(n_days):
+            x = t[row, i]
+            if x < t1:
+                values[b, i] = math.exp(r1 * x)
+            else:
+                sigmoid = 0.5 * (1.0 + math.tanh(0.5 * r2 * (x - x0)))
+                values[b, i] = exp_t1 + K * (sigmoid - sigmoid_t1)
+
+    return values
+
+
+def _containment_growth_jacobian_kernel(t, params):
+    """jacobian of containment_growth with respect to (x0, K, r1, r2, t1), in a single pass"""
+    n_batch, n_days = params.shape[0], t.shape[1]
+    jacobian = np.zeros((n_batch, n_days, 5))
+    for b in range(n_batch):
+        x0, K, r1, r2, t1 = (
+            params[b, 0],
+            params[b, 1],
+            params[b, 2],
+            params[b, 3],
+            params[b, 4],
+        )
+        row = b if t.shape[0] > 1 else 0
+        exp_t1 = math.exp(r1 * t1)
+        s1 = 0.5 * (1.0 + math.tanh(0.5 * r2 * (t1 - x0)))
+        ds1 = s1 * (1.0 - s1)
+        for i in range(n_days):
+            x = t[row, i]
+            if x < t1:
+                # --- before t1 the curve only depends on r1 --- #
+                jacobian[b, i, 2] = x * math.exp(r1 * x)
+            else:
+                s = 0.5 * (1.0 + math.tanh(0.5 * r2 * (x - x0)))
+                ds = s * (1.0 - s)
+                jacobian[b, i, 0] = K * r2 * (ds1 - ds)
+                jacobian[b, i, 1] = s - s1
+                jacobian[b, i, 2] = t1 * exp_t1
+                jacobian[b, i, 3] = K * ((x - x0) * ds - (t1 - x0) * ds1)
+                jacobian[b, i, 4] = r1 * exp_t1 - K * r2 * ds1
+
+    return jacobian
+
+
+def _containment_growth_values_numpy(t, params):
+    x0, K, r1, r2, t1 = (params[:, i : i + 1] for i in range(5))
+    sigmoid = 0.5 * (1 + np.tanh(0.5 * r2 * (t - x0)))
+    sigmoid_t1 = 0.5 * (1 + np.tanh(0.5 * r2 * (t1 - x0)))
+    return np.where(
+        t < t1,
+        np.exp(r1 * np.minimum(t, t1)),
+        np.exp(r1 * t1) + K * (sigmoid - sigmoid_t1),
+    )
+
+
+def _containment_growth_jacobian_numpy(t, params):
+    x0, K, r1, r2, t1 = (params[:, i : i + 1] for i in range(5))
+    s = 0.5 * (1 + np.tanh(0.5 * r2 * (t - x0)))
+    s1 = 0.5 * (1 + np.tanh(0.5 * r2 * (t1 - x0)))
+    ds = s * (1 - s)
+    ds1 = s1 * (1 - s1)
+    exp_t1 = np.exp(r1 * t1)
+
+    jacobian = np.stack(
+        np.broadcast_arrays(
+            K * r2 * (ds1 - ds),
+            s - s1,
+            t1 * exp_t1,
+            K * ((t - x0) * ds - (t1 - x0) * ds1),
+            r1 * exp_t1 - K * r2 * ds1,
+        ),
+        axis=-1,
+    )
+
+    # --- before t1 the curve only depends on r1 --- #
+    before = np.broadcast_to(t < t1, jacobian.shape[:-1])
+    jacobian[before] = 0.0
+    jacobian[..., 2] += np.where(before, t * np.exp(r1 * np.minimum(t, t1)), 0.0)
+
+    return jacobian
+
+
+# --- public kernels: sigmoid_loss(t, values, weight, x0, K, r, mad=False), the     --- #
+# --- weighted MSE or MAD of the sigmoid with weight summing to one for a mean,     --- #
+# --- and containment_growth_values(t, params) and containment_growth_jacobian(t,    --- #
+# --- params), the curve and jacobian of each row of params of shape (n_batch, 5)  --- #
+# --- on its row of t of shape (n_batch, n_days) or (1, n_days). They are compiled  --- #
+# --- on first access so that importing the module does not load numba            --- #
+_KERNELS = {
+    "sigmoid_loss": (_sigmoid_loss_kernel, _sigmoid_loss_numpy),
+    "containment_growth_values": (
+        _containment_growth_values_kernel,
+        _containment_growth_values_numpy,
+    ),
+    "containment_growth_jacobian": (
+        _containment_growth_jacobian_kernel,
+        _containment_growth_jacobian_numpy,
+    ),
+}
+
+
+def __getattr__(name):
+    """compile the kernel name with numba, or fall back to numpy, on first access"""
+    if name not in _KERNELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    kernel, numpy_kernel = _KERNELS[name]
+    if BACKEND == "numba":
+        import numba
+
+        function = numba.njit(cache=True)(kernel)
+    else:
+        function = numpy_kernel
+
+    # --- later accesses find the function without calling __getattr__ --- #
+    globals()[name] = function
+
+    return function
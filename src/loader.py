@@ -0,0 +1,63 @@
+import pandas as pd
+from pandas.api.types import CategoricalDtype, union_categoricals
+
+# --- columns of the OWID dataset used by the project and their compact dtype --- #
+OWID_DTYPES = {
+    "date": "str",
+    "location": "category",
+    "new_cases_smoothed": "float32",
+    "total_cases": "float64",
+    "new_deaths_smoothed": "float32",
+    "total_deaths": "float64",
+}
+
+OWID_RENAME = {"new_cases_smoothed": "new_cases", "new_deaths_smoothed": "new_deaths"}
+
+
+def load_owid_data(path, locations=None, chunksize=100_000):
+    """
+    Read the Our World In Data covid 19 dataset by chunks keeping only the needed
+    columns and locations, each chunk is filtered and typed while reading so that
+    the whole file is never held in memory
+
+    Parameters
+    ----------
+    path: path or binary file object of the OWID csv file
+    locations: list of locations to keep, all locations if None
+    chunksize: number of rows read at once
+
+    Returns
+    -------
+    pd.DataFrame with the columns date, location, new_cases, total_cases,
+    new_deaths, total_deaths and date_str
+    """
+
+    dtypes = dict(OWID_DTYPES)
+    if locations is not None:
+        # --- locations outside of the categories are read as NaN and dropped --- #
+        dtypes["location"] = CategoricalDtype(categories=list(locations))
+
+    reader = pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize)
+    chunks = [_prepare_chunk(chunk, dtypes) for chunk in reader]
+
+    # --- chunks share their categories so that the concat keeps a category --- #
+    categories = union_categoricals(
+        [chunk.location for chunk in chunks], sort_categories=True
+    ).categories
+    for chunk in chunks:
+        chunk["location"] = chunk.location.cat.set_categories(categories)
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _prepare_chunk(chunk, dtypes):
+    """keep the rows of a chunk with all the needed values, renamed and typed"""
+    chunk = chunk.loc[:, list(dtypes)].rename(columns=OWID_RENAME).dropna()
+    chunk[["new_cases", "new_deaths"]] = chunk[["new_cases", "new_deaths"]].astype(
+        "int32"
+    )
+
+    chunk["date"] = pd.to_datetime(chunk.date, format="%Y-%m-%d")
+    chunk["date_str"] = chunk.date.dt.strftime("%d/%m/%Y")
+
+    return chunk
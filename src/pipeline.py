@@ -0,0 +1,253 @@
+import hashlib
+import inspect
+import json
+import logging
+from pathlib import Path
+
+from src import instrument
+from src.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(path, chunk_size=2**20):
+    """
+    Compute the sha256 of the content of a file, or of the relative path and the
+    content of every file of a folder
+
+    Returns
+    -------
+    hexadecimal sha256, None if path does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    files = (
+        [path] if path.is_file() else sorted(p for p in path.rglob("*") if p.is_file())
+    )
+
+    digest = hashlib.sha256()
+    for file in files:
+        # --- the size separates the contents of consecutive files --- #
+        digest.update(f"{file.relative_to(path)}:{file.stat().st_size};".encode())
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def code_fingerprint(code):
+    """sha256 of the source of modules and functions, and of the repr of constants"""
+    digest = hashlib.sha256()
+    for obj in code:
+        if inspect.ismodule(obj) or inspect.isroutine(obj) or inspect.isclass(obj):
+            digest.update(inspect.getsource(obj).encode())
+        else:
+            digest.update(repr(obj).encode())
+
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    Step of a Pipeline reading and writing artifacts, run again only if its inputs,
+    its parameters or its code changed since its last run, or if its outputs were
+    modified since
+
+    Parameters
+    ----------
+    name: name of the stage
+    func: function called with the path of each input and output as keyword
+        arguments named after the artifacts, followed by params
+    inputs: names of the artifacts read by the stage
+    outputs: names of the artifacts written by the stage
+    params: keyword arguments of func changing its outputs, default=None
+    code: modules, functions and constants the outputs depend on, their source
+        or repr is part of the fingerprint of the stage, default=None for func
+    always: whether or not to run the stage at every run, for a stage reading an
+        external resource such as a download, default=False
+    """
+
+    def __init__(
+        self, name, func, inputs=(), outputs=(), params=None, code=None, always=False
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.code = [func] if code is None else list(code)
+        self.always = always
+
+
+class Pipeline:
+    """
+    Stages declared with their input and output artifacts, run in order. Every
+    artifact is fingerprinted from its content, a stage is skipped when the
+    fingerprints of its inputs, parameters and code are the ones of its last run
+    and its outputs were not modified since. A stage rewriting identical outputs
+    does not rerun the stages downstream of it.
+
+    Parameters
+    ----------
+    artifacts: dictionary {name: path} of the files and folders read or written
+        by the stages
+    stages: list of Stage in order of execution, each input is written by a
+        previous stage or exists before the run
+    state_path: JSON file keeping the fingerprints of the last run of each stage
+    """
+
+    def __init__(self, artifacts, stages, state_path):
+        self.artifacts = {name: Path(path) for name, path in artifacts.items()}
+        self.stages = list(stages)
+        self.state_path = Path(state_path)
+
+        self.producers = {}
+        for stage in self.stages:
+            for name in stage.inputs + stage.outputs:
+                if name not in self.artifacts:
+                    raise ValueError(f"{stage.name}: unknown artifact {name}")
+            for name in stage.inputs:
+                if name in stage.outputs:
+                    raise ValueError(f"{stage.name}: {name} is an input and an output")
+            for name in stage.outputs:
+                if name in self.producers:
+                    raise ValueError(
+                        f"{name} is written by {self.producers[name].name} "
+                        f"and {stage.name}"
+                    )
+                self.producers[name] = stage
+
+        # --- an input is written by a previous stage so that one pass is enough --- #
+        for position, stage in enumerate(self.stages):
+            for name in stage.inputs:
+                producer = self.producers.get(name)
+                if producer is not None and self.stages.index(producer) > position:
+                    raise ValueError(
+                        f"{stage.name} reads {name} written later by {producer.name}"
+                    )
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        with atomic_write(self.state_path) as f:
+            json.dump(state, f, indent=2)
+
+    def upstream(self, targets=None):
+        """return the stages needed to bring the stages targets up to date, in order"""
+        if targets is None:
+            return list(self.stages)
+
+        stages = {stage.name: stage for stage in self.stages}
+        unknown = set(targets) - set(stages)
+        if unknown:
+            raise ValueError(f"unknown stages {sorted(unknown)}")
+
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            pending.extend(
+                self.producers[artifact].name
+                for artifact in stages[name].inputs
+                if artifact in self.producers
+            )
+
+        return [stage for stage in self.stages if stage.name in needed]
+
+    def stage_key(self, stage, input_fingerprints):
+        """fingerprint of the inputs, parameters and code of a stage"""
+        digest = hashlib.sha256()
+        digest.update(stage.name.encode())
+        digest.update(code_fingerprint(stage.code).encode())
+        digest.update(repr(sorted(stage.params.items())).encode())
+        for name in stage.inputs:
+            digest.update(f"{name}={input_fingerprints[name]};".encode())
+
+        return digest.hexdigest()
+
+    def run(self, targets=None, force=(), options=None):
+        """
+        Run the stages whose inputs, parameters or code changed since their last run
+
+        Parameters
+        ----------
+        targets: names of the stages to bring up to date with the stages upstream
+            of them, default=None for all the stages
+        force: names of the stages run even if they are up to date, default=()
+        options: dictionary {stage name: keyword arguments} passed to a stage without
+            being part of its fingerprint, ex: the locations to refresh, a stage run
+            with options is run again by the next run without, default=None
+
+        Returns
+        -------
+        dictionary {stage name: "ran" or "skipped"}
+        """
+        options = options or {}
+        state = self._read_state()
+        fingerprints = {}
+
+        def artifact_fingerprint(name):
+            if name not in fingerprints:
+                fingerprints[name] = fingerprint(self.artifacts[name])
+            return fingerprints[name]
+
+        status = {}
+        for stage in self.upstream(targets):
+            inputs = {name: artifact_fingerprint(name) for name in stage.inputs}
+            missing = [name for name, value in inputs.items() if value is None]
+            if missing:
+                raise FileNotFoundError(
+                    f"{stage.name}: missing inputs "
+                    + ", ".join(f"{name} ({self.artifacts[name]})" for name in missing)
+                )
+
+            key = self.stage_key(stage, inputs)
+            previous = state.get(stage.name, {})
+            up_to_date = (
+                not stage.always
+                and stage.name not in force
+                and stage.name not in options
+                and previous.get("key") == key
+                and all(
+                    previous["outputs"].get(name) == artifact_fingerprint(name)
+                    for name in stage.outputs
+                )
+            )
+
+            if up_to_date:
+                logger.info(f"stage {stage.name} up to date")
+                status[stage.name] = "skipped"
+            else:
+                logger.info(f"stage {stage.name} running")
+                paths = {
+                    name: self.artifacts[name] for name in stage.inputs + stage.outputs
+                }
+                stage.func(**paths, **stage.params, **options.get(stage.name, {}))
+
+                for name in stage.outputs:
+                    fingerprints.pop(name, None)
+                state[stage.name] = {
+                    # --- a partial run with options is not a run of the stage --- #
+                    "key": None if stage.name in options else key,
+                    "outputs": {
+                        name: artifact_fingerprint(name) for name in stage.outputs
+                    },
+                }
+                self._write_state(state)
+                status[stage.name] = "ran"
+
+            instrument.count(f"pipeline.{status[stage.name]}")
+            instrument.record("pipeline", stage=stage.name, status=status[stage.name])
+
+        return status
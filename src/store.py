@@ -0,0 +1,187 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.files import atomic_write
+from src.loader import load_owid_data
+
+# --- columns stored for each location and their dtype on disk --- #
+STORE_DTYPES = {
+    "date": "datetime64[ns]",
+    "new_cases": "int32",
+    "total_cases": "float64",
+    "new_deaths": "int32",
+    "total_deaths": "float64",
+}
+
+
+class CaseStore:
+    """
+    Columnar store of the case dataset partitioned by location. Each location has its
+    own folder with one raw binary file per column, read back with memory mapping,
+    and a meta.json file holding its number of rows and last date. The store is
+    append only: rows older than the last stored date of a location are ignored.
+
+    Parameters
+    ----------
+    root : folder of the store
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _partition(self, location: str) -> Path:
+        return self.root / location.replace("/", "_")
+
+    def _read_meta(self, location: str):
+        try:
+            with open(self._partition(location) / "meta.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def locations(self):
+        """return the list of locations in the store"""
+        if not self.root.exists():
+            return []
+
+        return sorted(
+            json.loads((path / "meta.json").read_text())["location"]
+            for path in self.root.iterdir()
+            if (path / "meta.json").exists()
+        )
+
+    def max_date(self, location: str):
+        """return the last stored date of location, None if the location is not stored"""
+        meta = self._read_meta(location)
+        if meta is None or meta["max_date"] is None:
+            return None
+
+        return pd.Timestamp(meta["max_date"])
+
+    def append(self, data: pd.DataFrame):
+        """
+        Append the rows of data newer than the last stored date of their location
+
+        Parameters
+        ----------
+        data : pd.DataFrame with a location column and the columns of STORE_DTYPES
+
+        Returns
+        -------
+        number of rows appended
+        """
+        n_appended = 0
+
+        for location, data_location in data.groupby("location", observed=True):
+            max_date = self.max_date(location)
+            if max_date is not None:
+                data_location = data_location[data_location.date > max_date]
+            if data_location.shape[0] == 0:
+                continue
+
+            data_location = data_location.sort_values("date")
+            self._append_location(location, data_location)
+            n_appended += data_location.shape[0]
+
+        return n_appended
+
+    def _append_location(self, location: str, data_location: pd.DataFrame):
+        partition = self._partition(location)
+        partition.mkdir(parents=True, exist_ok=True)
+
+        meta = self._read_meta(location) or {
+            "location": location,
+            "n_rows": 0,
+            "max_date": None,
+        }
+
+        for column, dtype in STORE_DTYPES.items():
+            values = data_location[column].to_numpy().astype(dtype)
+            path = partition / f"{column}.bin"
+            with open(path, "ab") as f:
+                # --- drop the bytes of an interrupted append not counted in meta --- #
+                f.truncate(meta["n_rows"] * values.itemsize)
+                f.write(values.tobytes())
+
+        # --- meta is written last so that readers only see complete appends --- #
+        meta["n_rows"] += data_location.shape[0]
+        meta["max_date"] = str(data_location.date.max())
+
+        with atomic_write(partition / "meta.json") as f:
+            json.dump(meta, f)
+
+    def read_location(self, location: str) -> pd.DataFrame:
+        """
+        Read the data of a single location, only the files of its partition are read
+
+        Parameters
+        ----------
+        location : location to read
+
+        Returns
+        -------
+        pd.DataFrame with the same columns as load_owid_data
+        """
+        meta = self._read_meta(location)
+        if meta is None:
+            raise KeyError(f"{location} is not in the store {self.root}")
+
+        partition = self._partition(location)
+        data = pd.DataFrame(
+            {
+                column: (
+                    np.memmap(
+                        partition / f"{column}.bin",
+                        dtype=dtype,
+                        mode="r",
+                        shape=(meta["n_rows"],),
+                    )
+                    if meta["n_rows"] > 0
+                    else np.empty(0, dtype=dtype)
+                )
+                for column, dtype in STORE_DTYPES.items()
+            }
+        )
+        data.insert(1, "location", location)
+        data["date_str"] = data.date.dt.strftime("%d/%m/%Y")
+
+        return data
+
+    def read(self, locations=None) -> pd.DataFrame:
+        """
+        Read the data of several locations
+
+        Parameters
+        ----------
+        locations : list of locations to read, all locations if None
+
+        Returns
+        -------
+        pd.DataFrame with the same columns as load_owid_data
+        """
+        if locations is None:
+            locations = self.locations()
+
+        return pd.concat(
+            [self.read_location(location) for location in locations], ignore_index=True
+        )
+
+
+def ingest_owid_csv(path, store: CaseStore, locations=None):
+    """
+    Append to the store the rows of the OWID csv file newer than the stored ones
+
+    Parameters
+    ----------
+    path : path or binary file object of the OWID csv file
+    store : CaseStore to update
+    locations : list of locations to ingest, all locations if None
+
+    Returns
+    -------
+    number of rows appended
+    """
+    return store.append(load_owid_data(path, locations=locations))
@@ -1,73 +1,217 @@
 import pandas as pd
 import numpy as np
-from scipy.optimize import minimize
-import seaborn as sns
-from sklearn.base import BaseEstimator
 import datetime
+import inspect
+import logging
+import time
 
+from src import instrument, kernels
 
-def get_country(data: pd.DataFrame, location: str):
+# --- scipy, joblib and seaborn are imported by the functions using them, so --- #
+# --- that importing the module stays fast for the server and the scripts    --- #
+
+logger = logging.getLogger(__name__)
+
+
+class LocationIndex:
+    """
+    Dataset sorted by location with the contiguous row range of each location, the
+    rows of a location are returned as a slice without scanning the whole dataset
+
+    Parameters
+    ----------
+    data: pd.DataFrame with a location column, rows of a location sorted by date
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        locations = data.location.to_numpy().astype(str)
+        order = np.argsort(locations, kind="stable")
+
+        self.data = data.iloc[order]
+        self.locations, starts = np.unique(locations[order], return_index=True)
+        stops = np.append(starts[1:], len(order))
+        self.offsets = {
+            location: (start, stop)
+            for location, start, stop in zip(self.locations, starts, stops)
+        }
+
+        # --- running maximum of total_cases per location for the min count cuts --- #
+        self.max_total_cases = None
+        if "total_cases" in data.columns:
+            self.max_total_cases = (
+                self.data.total_cases.groupby(locations[order]).cummax().to_numpy()
+            )
+
+    def get(self, location: str, min_count_total=None) -> pd.DataFrame:
+        """
+        return the rows of location, from the first day total_cases reaches
+        min_count_total if min_count_total is not None
+        """
+        start, stop = self.offsets.get(location, (0, 0))
+
+        if min_count_total is not None:
+            start += np.searchsorted(
+                self.max_total_cases[start:stop], min_count_total, side="left"
+            )
+
+        return self.data.iloc[start:stop]
+
+
+def get_country(data, location: str):
     """return the projection of the DataFrame with the selected country"""
+    if isinstance(data, LocationIndex):
+        return data.get(location)
+
     return data[data.location == location]
 
 
-def get_country_and_min_count(data: pd.DataFrame, location: str, min_count_total=15):
+def get_country_and_min_count(data, location: str, min_count_total=15):
     """return the projection of the DataFrame with the selected country"""
+    if isinstance(data, LocationIndex):
+        return data.get(location, min_count_total)
+
     return data.loc[(data.location == location) & (data.total_cases >= min_count_total)]
 
 
-def get_min_count(data: pd.DataFrame, min_count_total=15):
+def get_min_count(data, min_count_total=15):
     """return the projection of the DataFrame with the selected country"""
+    if isinstance(data, LocationIndex):
+        return data.data[data.max_total_cases >= min_count_total]
+
     return data.loc[(data.total_cases >= min_count_total)]
 
 
-def data_china_smoothing(data: pd.DataFrame, n_days_smoothing: int, n_cases_true=4000):
+def format_thousands(values):
     """
-    smooth new cases data from 2020-02-13 where the covid 19 cases
-    definition changed in china
+    format the integer part of values with a comma as thousands separator,
+    ex: 1234567.8 -> "1,234,567"
 
     Parameters
     ----------
-    data: Covid 19 dataset
-    n_days_smoothing: number of days the 2020-02-13 should be smoothed
-    n_cases_true: Number of true cases the count definition changed
+    values: array of numbers
+
+    Returns
+    -------
+    list of strings
     """
+    # --- truncate all values at once and format native python integers --- #
+    return list(map("{:,}".format, np.asarray(values).astype(np.int64).tolist()))
 
-    data_china = get_country(data, "China").copy()
-    date_change_count = "2020-02-13"
-    date_begin_smooth = datetime.datetime(2020, 2, 13) - datetime.timedelta(
-        days=n_days_smoothing - 1
-    )
 
-    time_mask = (data_china.date >= date_begin_smooth) & (
-        data_china.date < date_change_count
-    )
-    data_to_change = data_china[time_mask].copy()
+def correct_discontinuities(data: pd.DataFrame, corrections, location_suffix=None):
+    """
+    Redistribute the excess of new cases reported on the day of a reporting
+    discontinuity, ex: a change of the cases definition or a backfill, over the
+    previous days with linearly increasing weights. All the corrections are applied
+    at once, the day of a correction keeps its true count and the total cases of
+    the previous days include the redistributed cases, the total cases from the
+    day of the correction are unchanged.
+
+    Parameters
+    ----------
+    data: Covid 19 dataset, the rows of a location being sorted by date
+    corrections: pd.DataFrame of the discontinuities with the columns location, date,
+        true_count, the number of new cases of the day without the excess, and
+        n_days, the number of days over which the day is smoothed, itself included
+    location_suffix: None to correct the rows of data in place, otherwise the
+        corrected rows of the corrected locations are returned as the new locations
+        location + location_suffix and data is left unchanged
 
-    new_cases_to_smooth = (
-        data_china.loc[data_china.date == date_change_count, "new_cases"].values[0]
-        - n_cases_true
+    Returns
+    -------
+    data corrected in place if location_suffix is None, otherwise the corrected rows
+    of the corrected locations only
+    """
+    corrections = pd.DataFrame(corrections)
+    if location_suffix is not None:
+        data = data[data.location.isin(corrections.location)].copy()
+
+    # --- rows sorted by (location, day) so that each window is a row range --- #
+    codes, location_names = pd.factorize(data.location.astype(str))
+    days = data.date.to_numpy().astype("datetime64[D]").astype(np.int64)
+    first_day = days.min() if days.shape[0] > 0 else 0
+    span = np.int64(days.max() - first_day + 1) if days.shape[0] > 0 else 1
+    keys = codes * span + (days - first_day)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    correction_codes = location_names.get_indexer(corrections.location.astype(str))
+    correction_days = (
+        pd.to_datetime(corrections.date).to_numpy().astype("datetime64[D]")
+    ).astype(np.int64) - first_day
+    correction_keys = correction_codes * span + correction_days
+    n_days = corrections.n_days.to_numpy(dtype=np.int64)
+
+    # --- the day of each correction and the first day of its window --- #
+    target = np.searchsorted(sorted_keys, correction_keys)
+    first = np.searchsorted(
+        sorted_keys,
+        correction_codes * span + np.maximum(correction_days - (n_days - 1), 0),
     )
+    found = (correction_codes >= 0) & (target < len(keys))
+    found[found] &= sorted_keys[target[found]] == correction_keys[found]
+    if not found.all():
+        missing = corrections.loc[~found, ["location", "date"]]
+        raise KeyError(f"no row for the corrections {missing.to_dict('records')}")
+
+    new_cases = data.new_cases.to_numpy(dtype=np.int64, copy=True)
+    total_cases = data.total_cases.to_numpy(dtype=float, copy=True)
+    excess = new_cases[order[target]] - corrections.true_count.to_numpy(np.int64)
+
+    # --- k-th day of each window receives k / sum(1..n) of the excess, rounded --- #
+    # --- on the cumulative sum so that the whole excess is redistributed       --- #
+    length = target - first
+    window = np.repeat(np.arange(len(target)), length)
+    k = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length) + 1
+    share = k * (k + 1) / np.maximum(length * (length + 1), 1)[window]
+    cumulative = np.round(share * excess[window]).astype(np.int64)
+    previous = np.concatenate([[0], cumulative[:-1]])
+    previous[k == 1] = 0
+
+    rows = order[np.repeat(first, length) + k - 1]
+    np.add.at(new_cases, rows, cumulative - previous)
+    np.add.at(total_cases, rows, cumulative)
+    new_cases[order[target]] -= excess
+
+    data["new_cases"] = new_cases.astype(data.new_cases.dtype)
+    data["total_cases"] = total_cases
+    if location_suffix is not None:
+        data["location"] = data.location.astype(str) + location_suffix
 
-    # --- remove new_cases to total_cases to add smoothed new_cases afterward --- #
-    data_to_change["total_cases"] -= np.cumsum(data_to_change["new_cases"])
+    return data
 
-    # --- Smooth new_cases over the period  --- #
-    index = np.arange(1, n_days_smoothing, 1)
-    data_to_change["new_cases"] += index * new_cases_to_smooth / np.sum(index)
-    data_to_change["new_cases"] = data_to_change["new_cases"].astype("int16")
 
-    data_to_change["total_cases"] += np.cumsum(data_to_change["new_cases"])
+# --- smoothing of the change of the cases definition in China used by the daily --- #
+# --- update and the bokeh server, see data_china_smoothing                     --- #
+CHINA_SMOOTHING = {"n_days_smoothing": 6, "n_cases_true": 5000}
 
-    # --- add smoothed data ---- #
 
-    data_china[time_mask] = data_to_change
-    data_china.loc[data_china.date == date_change_count, "new_cases"] = n_cases_true
-    data_china["location"] = "China Smooth"
+def data_china_smoothing(data: pd.DataFrame, n_days_smoothing: int, n_cases_true=4000):
+    """
+    smooth new cases data from 2020-02-13 where the covid 19 cases
+    definition changed in china
 
-    data = pd.concat([data, data_china])
+    Parameters
+    ----------
+    data: Covid 19 dataset
+    n_days_smoothing: number of days the 2020-02-13 should be smoothed
+    n_cases_true: Number of true cases the count definition changed
 
-    return data
+    Returns
+    -------
+    smoothed china data as the location "China Smooth", only the rows of China are
+    copied so that the caller appends them to data in a single concat
+    """
+    corrections = pd.DataFrame(
+        {
+            "location": ["China"],
+            "date": [pd.Timestamp("2020-02-13")],
+            "true_count": [n_cases_true],
+            "n_days": [n_days_smoothing],
+        }
+    )
+
+    return correct_discontinuities(data, corrections, location_suffix=" Smooth")
 
 
 def sigmoid(x, x0, K, r):
@@ -89,6 +233,317 @@ def sigmoid(x, x0, K, r):
     return K / (1 + np.exp(-r * (x - x0)))
 
 
+def sigmoid_jacobian(x, x0, K, r):
+    """
+    Compute the partial derivatives of the generalized logistic function with
+    respect to its parameters (x0, K, r)
+
+    Parameters
+    ----------
+    x: input function
+    x0: lag of the generalized logistic function
+    K: asymptote of the generalized logistic function
+    r: generalized logistic function parameter
+
+    Returns
+    -------
+    array of shape x.shape + (3,) containing d/dx0, d/dK and d/dr
+    """
+    from scipy.special import expit
+
+    shift = x - x0
+    s = expit(r * shift)
+    ds = K * s * (1 - s)
+
+    # --- the derivatives are written in place instead of stacked in a copy --- #
+    jacobian = np.empty(ds.shape + (3,))
+    np.multiply(-r, ds, out=jacobian[..., 0])
+    jacobian[..., 1] = s
+    np.multiply(shift, ds, out=jacobian[..., 2])
+
+    return jacobian
+
+
+def fit_sigmoid_batched(
+    t, y, init, loss="MSE", max_iter=200, tol=1e-10, sample_weight=None
+):
+    """
+    Fit a generalized logistic function on each row of (t, y) at once with a
+    vectorized Levenberg-Marquardt algorithm using the analytic jacobian of the
+    sigmoid. The MAD loss is minimised with iteratively reweighted least squares.
+
+    Parameters
+    ----------
+    t: array of shape (n_batch, n_days) or (1, n_days) of input values
+    y: array of shape (n_batch, n_days) or (1, n_days) of values to fit
+    init: array of shape (n_batch, 3) of initial parameters (x0, K, r)
+    loss: "MSE" or "MAD"
+    max_iter: maximum number of iterations
+    tol: relative decrease of the loss under which a row is considered converged,
+        a float or an array of shape (n_batch,) of the tolerance of each row
+    sample_weight: array of shape (n_batch, n_days) of weights of each day in the
+        loss of each row, default=None
+
+    Returns
+    -------
+    array of shape (n_batch, 3) of fitted parameters, arrays of shape (n_batch,) of
+    the number of iterations of each row and of whether it converged before max_iter
+    """
+    params, n_iter, _, converged = fit_curve_batched(
+        sigmoid_curve,
+        lambda t, p: sigmoid_jacobian(t, *_split_params(p)),
+        t,
+        y,
+        init,
+        loss=loss,
+        max_iter=max_iter,
+        tol=tol,
+        sample_weight=sample_weight,
+    )
+
+    return params, n_iter, converged
+
+
+def fit_curve_batched(
+    curve,
+    jacobian,
+    t,
+    y,
+    init,
+    loss="MSE",
+    max_iter=200,
+    tol=1e-10,
+    sample_weight=None,
+    bounds=None,
+):
+    """
+    Fit a parametric curve on each row of (t, y) at once with a vectorized
+    Levenberg-Marquardt algorithm, parameters being projected on their bounds after
+    each step. The MAD loss is minimised with iteratively reweighted least squares.
+
+    Parameters
+    ----------
+    curve: function of (t, params) returning the values of shape (n_batch, n_days)
+        of the curve of each row of params
+    jacobian: function of (t, params) returning the jacobian of shape
+        (n_batch, n_days, n_params) of the curve with respect to its parameters
+    t: array of shape (n_batch, n_days) or (1, n_days) of input values
+    y: array of shape (n_batch, n_days) or (1, n_days) of values to fit
+    init: array of shape (n_batch, n_params) of initial parameters
+    loss: "MSE" or "MAD"
+    max_iter: maximum number of iterations
+    tol: relative decrease of the loss under which a row is considered converged,
+        a float or an array of shape (n_batch,) of the tolerance of each row
+    sample_weight: array of shape (n_batch, n_days) of weights of each day in the
+        loss of each row, default=None
+    bounds: (lower, upper) arrays broadcastable to init, default=None
+
+    Returns
+    -------
+    array of shape (n_batch, n_params) of fitted parameters, arrays of shape
+    (n_batch,) of the number of iterations and of the final loss of each row, and
+    of whether each row stopped before max_iter because its loss decreased by less
+    than tol or no step decreased it
+    """
+
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    params = np.array(init, dtype=float)
+    n_batch, n_params = params.shape
+
+    if sample_weight is None:
+        sample_weight = np.ones((1, 1))
+
+    lower, upper = (-np.inf, np.inf) if bounds is None else bounds
+    lower = np.broadcast_to(lower, params.shape)
+    upper = np.broadcast_to(upper, params.shape)
+
+    # --- parameters are optimised relatively to their initial value --- #
+    scale = np.where(np.abs(params) > 0, np.abs(params), 1.0)
+    y_scale = np.maximum(np.max(np.abs(y), axis=1, keepdims=True), 1.0)
+
+    def weights(r, sample_weight):
+        if loss == "MAD":
+            return sample_weight / np.maximum(np.abs(r), 1e-6)
+        return np.broadcast_to(sample_weight, r.shape)
+
+    # --- the loop works on compact copies of the rows still optimised, rows --- #
+    # --- are frozen once converged and dropped from the copies by batches    --- #
+    rows = np.arange(n_batch)
+    state = {
+        "t": t,
+        "y": y,
+        "sample_weight": sample_weight,
+        "y_scale": y_scale,
+        "scale": scale,
+        "lower": lower,
+        "upper": upper,
+        "params": params.copy(),
+        "tol": np.reshape(np.asarray(tol, dtype=float), -1),
+    }
+    r = (curve(t, params) - y) / y_scale
+    w = np.array(weights(r, sample_weight))
+    state.update(r=r, w=w, cost=np.sum(w * r**2, axis=1))
+    state["damping"] = np.full(n_batch, 1e-3)
+    state["n_iter"] = np.zeros(n_batch, dtype=int)
+    state["converged"] = np.zeros(n_batch, dtype=bool)
+    running = np.ones(n_batch, dtype=bool)
+
+    # --- results of every row, written once a row is frozen --- #
+    results = {
+        "params": params,
+        "cost": state["cost"].copy(),
+        "n_iter": state["n_iter"].copy(),
+        "converged": state["converged"].copy(),
+    }
+
+    for _ in range(max_iter):
+        p, r, w = state["params"], state["r"], state["w"]
+        jac = jacobian(state["t"], p)
+        jac *= state["scale"][:, None, :] / state["y_scale"][:, :, None]
+
+        # --- damped normal equations for every running row --- #
+        jw_transpose = (jac * w[:, :, None]).transpose(0, 2, 1)
+        hessian = jw_transpose @ jac
+        gradient = (jw_transpose @ r[:, :, None])[:, :, 0]
+        diag = np.einsum("bii->bi", hessian) + 1e-12
+        hessian += (state["damping"][:, None] * diag)[:, :, None] * np.eye(n_params)
+        step = -_solve_batched(hessian, gradient)
+
+        candidate = np.clip(p + step * state["scale"], state["lower"], state["upper"])
+        r_candidate = (curve(state["t"], candidate) - state["y"]) / state["y_scale"]
+        cost_candidate = np.sum(w * r_candidate**2, axis=1)
+
+        row_cost = state["cost"]
+        improved = running & (cost_candidate < row_cost)
+        converged = improved & (row_cost - cost_candidate <= state["tol"] * row_cost)
+        state["n_iter"][running] += 1
+
+        p[improved] = candidate[improved]
+        r[improved] = r_candidate[improved]
+        state["damping"][improved] /= 3
+        state["damping"][running & ~improved] *= 2
+
+        # --- reweight the residuals for the MAD loss --- #
+        w[improved] = weights(r[improved], _rows(state["sample_weight"], improved))
+        row_cost[improved] = np.sum(w[improved] * r[improved] ** 2, axis=1)
+
+        # --- a row also stops once no step decreases its loss --- #
+        converged |= running & (state["damping"] >= 1e10)
+        state["converged"] |= converged
+        running &= ~converged
+        if not running.any():
+            break
+
+        if running.sum() < 0.9 * running.shape[0]:
+            # --- store the frozen rows and drop them from the compact copies --- #
+            for key, values in results.items():
+                values[rows[~running]] = state[key][~running]
+            state = {key: _rows(values, running) for key, values in state.items()}
+            rows = rows[running]
+            running = np.ones(rows.shape[0], dtype=bool)
+
+    for key, values in results.items():
+        values[rows] = state[key]
+
+    return results["params"], results["n_iter"], results["cost"], results["converged"]
+
+
+def _solve_batched(a, b):
+    """
+    solve each system a[i] x = b[i], with a least squares solution for the systems
+    numerically singular so that a single row cannot stop the whole batch
+    """
+    try:
+        return np.linalg.solve(a, b[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        solution = np.empty(b.shape)
+        for i, (a_i, b_i) in enumerate(zip(a, b)):
+            try:
+                solution[i] = np.linalg.solve(a_i, b_i)
+            except np.linalg.LinAlgError:
+                solution[i] = np.linalg.lstsq(a_i, b_i, rcond=None)[0]
+        return solution
+
+
+def _batched_convergence(n_iter, converged):
+    """
+    number of loss evaluations, maximum number of iterations and convergence
+    statistics of SigmoidModel of rows fitted by fit_curve_batched
+    """
+    return (
+        int(np.sum(n_iter + 1)),
+        int(np.max(n_iter, initial=0)),
+        {
+            "nfev": (n_iter + 1).tolist(),
+            "njev": n_iter.tolist(),
+            "success": converged.tolist(),
+        },
+    )
+
+
+def fit_sigmoid_least_squares(t, y, init, sample_weight=None, xtol=1e-8):
+    """
+    Fit a generalized logistic function with the MSE loss using a trust region
+    least squares solver and the analytic jacobian of the sigmoid. Parameters are
+    scaled by their initial value and residuals by the maximum of y.
+
+    Parameters
+    ----------
+    t: array of shape (n_days,) of input values
+    y: array of shape (n_days,) of values to fit
+    init: initial parameters (x0, K, r)
+    sample_weight: array of shape (n_days,) of weights of each day in the loss, default=None
+    xtol: relative change of the parameters under which the optimisation stops
+
+    Returns
+    -------
+    scipy OptimizeResult with the fitted parameters x and the convergence statistics
+    nfev, njev, status and success
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    init = np.asarray(init, dtype=float)
+
+    scale = np.where(np.abs(init) > 0, np.abs(init), 1.0)
+    y_scale = max(np.max(np.abs(y)), 1.0)
+
+    # --- weighted residuals: the sum of their squares is the weighted MSE --- #
+    row_scale = np.full(y.shape, 1 / y_scale)
+    if sample_weight is not None:
+        row_scale *= np.sqrt(sample_weight)
+
+    def residuals(x):
+        return row_scale * (sigmoid(t, *x) - y)
+
+    def jacobian(x):
+        return sigmoid_jacobian(t, *x) * row_scale[:, None]
+
+    from scipy.optimize import least_squares
+
+    return least_squares(
+        residuals, init, jac=jacobian, method="trf", x_scale=scale, xtol=xtol
+    )
+
+
+def _rows(values, rows):
+    """select rows of values, unless values has a single row shared by all rows"""
+    return values if values.shape[0] == 1 else values[rows]
+
+
+def _split_params(params):
+    """split an array of shape (n_batch, n_params) in broadcastable columns"""
+    return tuple(params[:, i : i + 1] for i in range(params.shape[1]))
+
+
+def sigmoid_curve(t, params):
+    """evaluate the sigmoid on each row of t with the matching row of params"""
+    from scipy.special import expit
+
+    x0, K, r = _split_params(params)
+    return K * expit(r * (t - x0))
+
+
 def two_mode_growth(x, x0, K, r1, r2, y, t1):
     """
     Compute the values of a generalized logistic function defined by x0, K, a and r
@@ -111,23 +566,349 @@ def two_mode_growth(x, x0, K, r1, r2, y, t1):
     )
 
 
-class SigmoidModel(BaseEstimator):
+def containment_growth(x, x0, K, r1, r2, t1):
+    """
+    Compute two_mode_growth with the containment indicator y = 1 from t1 on: an
+    exponential growth of rate r1 until t1 continued by the increase of a generalized
+    logistic function, the exponential being evaluated only until t1 so that it
+    cannot overflow
+
+    Parameters
+    ----------
+    x: input function
+    x0: lag of the generalized logistic function
+    K: asymptote of the generalized logistic function
+    r1: rate of the exponential growth before t1
+    r2: generalized logistic function parameter
+    t1: day of the containment
+
+    Returns
+    -------
+    image of x with two_mode_growth
+    """
+    from scipy.special import expit
+
+    return np.where(
+        x < t1,
+        np.exp(r1 * np.minimum(x, t1)),
+        np.exp(r1 * t1) + K * (expit(r2 * (x - x0)) - expit(r2 * (t1 - x0))),
+    )
+
+
+def containment_growth_derivative(x, x0, K, r1, r2, t1):
+    """compute the derivative of containment_growth with respect to x, the new cases"""
+    from scipy.special import expit
+
+    s = expit(r2 * (x - x0))
+    return np.where(x < t1, r1 * np.exp(r1 * np.minimum(x, t1)), K * r2 * s * (1 - s))
+
+
+def containment_growth_curve(t, params):
+    """
+    evaluate containment_growth on each row of t with the matching row of params,
+    with a kernel compiled with numba if installed
+    """
+    return kernels.containment_growth_values(t, params)
+
+
+def _converged_params(params, success):
+    """
+    return params with NaN for the bootstrap samples which did not converge, a warm
+    start from them then starts cold, params unchanged if success is None
+    """
+    if success is None:
+        return params
+
+    converged = np.asarray(success, dtype=bool)
+    return {
+        name: np.where(converged, values, np.nan).tolist()
+        for name, values in params.items()
+    }
+
+
+def _warm_start_params(init_params, k):
+    """return the k-th parameters of a parameters distribution, cycling if it is shorter"""
+    x_init = np.array(
+        [values[k % len(values)] for values in init_params.values()], dtype=float
+    )
+    return np.where(x_init == 0, 1e-8, x_init)
+
+
+# --- quantile of each parameter (x0, K, r) used for each predicted curve --- #
+PREDICTION_QUANTILES = {
+    "25%": [0.5, 0.25, 0.5],
+    "median": [0.5, 0.5, 0.5],
+    "75%": [0.5, 0.75, 0.5],
+}
+
+
+def quantile_params(params):
+    """
+    Compute the parameters of each curve of PREDICTION_QUANTILES for several fits at once
+
+    Parameters
+    ----------
+    params: array of shape (n_windows, n_bootstrap, 3) of bootstrap parameters (x0, K, r)
+
+    Returns
+    -------
+    array of shape (n_windows, n_quantiles, 3) of the parameters of each curve
+    """
+    levels = np.array(list(PREDICTION_QUANTILES.values()))
+    unique_levels, level_index = np.unique(levels, return_inverse=True)
+
+    # --- quantiles of shape (n_windows, 3, n_levels) computed in a single call --- #
+    values = np.moveaxis(np.quantile(params, unique_levels, axis=1), 0, -1)
+
+    return values[:, np.arange(3), level_index.reshape(levels.shape)]
+
+
+def _stack_by_bootstrap(params, func):
+    """
+    apply func to the stacked parameters of windows with the same number of bootstrap
+    samples, func maps an array (n_windows, n_bootstrap, n_params) to (n_windows, ...)
+    """
+    n_bootstrap = np.array([len(window_params) for window_params in params])
+
+    results = None
+    for n in np.unique(n_bootstrap):
+        windows = np.flatnonzero(n_bootstrap == n)
+        values = func(np.stack([params[w] for w in windows]))
+        if results is None:
+            results = np.empty((len(params),) + values.shape[1:])
+        results[windows] = values
+
+    return results
+
+
+def _prediction_frame(dates, values, derivative, index=None):
+    """
+    build the predictions DataFrame of the days dates from the values of shape
+    (n_rows, n_quantiles) of each curve of PREDICTION_QUANTILES and the derivative
+    of the median curve
+    """
+    median = values[:, list(PREDICTION_QUANTILES).index("median")]
+
+    # --- dates are formatted once per distinct day --- #
+    codes, unique_dates = pd.factorize(dates)
+    date_str = pd.DatetimeIndex(unique_dates).strftime("%d/%m/%Y").to_numpy()[codes]
+
+    columns = {"date": dates, "date_str": date_str}
+    columns.update(
+        {quantile: values[:, i] for i, quantile in enumerate(PREDICTION_QUANTILES)}
+    )
+    columns["derivative"] = derivative
+    columns["median_display"] = format_thousands(median)
+
+    return pd.DataFrame(columns, index=index)
+
+
+def predict_windows(params, start_dates, end_dates, n_days, model=None):
+    """
+    Compute the predictions of several fitted training windows in a single broadcast
+
+    Parameters
+    ----------
+    params: list of arrays of shape (n_bootstrap, n_params) of the bootstrap
+        parameters of each window
+    start_dates: first date of each training window, predicted at t = 1
+    end_dates: last date of each training window
+    n_days: number of predicted days of each window
+    model: class of the fitted model, default=SigmoidModel
+
+    Returns
+    -------
+    DataFrame of the predictions of every window with the columns date, date_str,
+    25%, median, 75%, derivative, median_display and date_end_train,
+    DataFrame of the parameters of each quantile with one row per parameter and window
+    """
+    model = SigmoidModel if model is None else model
+    n_windows = len(params)
+    n_days = np.broadcast_to(np.asarray(n_days, dtype=np.int64), (n_windows,))
+
+    # --- window and day of each predicted row --- #
+    offsets = np.concatenate([[0], np.cumsum(n_days)])
+    row_window = np.repeat(np.arange(n_windows), n_days)
+    row_day = np.arange(offsets[-1]) - offsets[row_window]
+
+    dates = np.asarray(start_dates, dtype="datetime64[ns]")[
+        row_window
+    ] + row_day.astype("timedelta64[D]")
+
+    with instrument.stage("predict_quantiles"):
+        values, derivative, quantiles = model.predict_quantiles(
+            params, row_window, row_day + 1
+        )
+
+    with instrument.stage("prediction_frame"):
+        fitted_sigmoid = _prediction_frame(dates, values, derivative, index=row_day)
+    fitted_sigmoid["date_end_train"] = np.asarray(end_dates, dtype="datetime64[ns]")[
+        row_window
+    ]
+
+    n_params = quantiles.shape[2]
+    paramters_values = pd.DataFrame(
+        quantiles.transpose(0, 2, 1).reshape(-1, len(PREDICTION_QUANTILES)),
+        columns=list(PREDICTION_QUANTILES),
+        index=np.tile(np.arange(n_params), n_windows),
+    )
+
+    return fitted_sigmoid, paramters_values
+
+
+def _stack_params(params):
+    """stack a dictionary of lists of parameters in an array of shape (n_bootstrap, n_params)"""
+    return np.column_stack(list(params.values()))
+
+
+class _Estimator:
+    """
+    get_params and set_params of the scikit-learn estimators, read from the
+    arguments of __init__, without importing scikit-learn
+    """
+
+    @classmethod
+    def _get_param_names(cls):
+        """sorted names of the arguments of __init__"""
+        parameters = inspect.signature(cls.__init__).parameters.values()
+        return sorted(
+            p.name
+            for p in parameters
+            if p.name != "self" and p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)
+        )
+
+    def get_params(self, deep=True):
+        """return the parameters of the estimator"""
+        return {name: getattr(self, name) for name in self._get_param_names()}
+
+    def set_params(self, **params):
+        """set the parameters of the estimator"""
+        valid_params = self._get_param_names()
+        for name, value in params.items():
+            if name not in valid_params:
+                raise ValueError(
+                    f"Invalid parameter {name} for estimator {type(self).__name__}"
+                )
+            setattr(self, name, value)
+
+        return self
+
+    def __repr__(self):
+        params = ", ".join(
+            f"{name}={value!r}" for name, value in self.get_params().items()
+        )
+        return f"{type(self).__name__}({params})"
+
+
+class SigmoidModel(_Estimator):
     """
     Parameters
     ----------
     n_bootstrap : Number of boostrap to estimate the distribution of the fitted parameters
     linear_proba : Whether or not to apply linear importance of the most recent values, default=True
+    loss : "MSE" or "MAD", default="MSE"
+    solver : "nelder-mead" to fit each bootstrap sample separately, "batched" to fit
+        all bootstrap samples at once with a vectorized Levenberg-Marquardt,
+        "least-squares" to fit each bootstrap sample with a trust region least squares
+        solver using the jacobian of the sigmoid, the MAD loss is then fitted with
+        nelder-mead, default="nelder-mead"
+    random_state : seed of the bootstrap sampling, default=None
+    warm_start_tol : relative change of the parameters, or relative decrease of the
+        loss for the "batched" solver, under which a warm started optimisation
+        stops, default=1e-4
+    bootstrap : "resample" to fit each bootstrap sample drawn with replacement,
+        "weights" to fit the original days weighted by their multinomial number of
+        draws, which is equivalent without copying the series, default="resample"
     """
 
-    def __init__(self, n_bootstrap=100, linear_proba=True, loss="MSE"):
+    def __init__(
+        self,
+        n_bootstrap=100,
+        linear_proba=True,
+        loss="MSE",
+        solver="nelder-mead",
+        random_state=None,
+        warm_start_tol=1e-4,
+        bootstrap="resample",
+    ):
         super(SigmoidModel).__init__()
         self.n_bootstrap = n_bootstrap
         self.linear_proba = linear_proba
         self.loss = loss
+        self.solver = solver
+        self.random_state = random_state
+        self.warm_start_tol = warm_start_tol
+        self.bootstrap = bootstrap
         self.params = {}
-        self.bootstrap_indexes = []
+        self.bootstrap_indexes = np.empty((0, 0), dtype=np.int32)
+        self.bootstrap_weights = np.empty((0, 0), dtype=np.int32)
+        self.n_evaluations = 0
+        self.convergence = {}
 
-    def fit(self, X: pd.DataFrame):
+    def _draw_bootstrap(self, rng, n_days):
+        """
+        draw the indexes of all bootstrap samples at once, or their multinomial
+        weights if bootstrap="weights", the other array being empty
+        """
+        # --- sample with a linear probability distribution if proba = True, uniform otherwise --- #
+        index_value = np.arange(n_days)
+        proba = np.full(n_days, 1 / n_days)
+        if self.linear_proba:
+            proba = index_value / np.sum(index_value)
+
+        bootstrap_indexes = np.empty((0, 0), dtype=np.int32)
+        bootstrap_weights = np.empty((0, 0), dtype=np.int32)
+        if self.bootstrap == "weights":
+            bootstrap_weights = rng.multinomial(
+                n_days, proba, size=self.n_bootstrap
+            ).astype(np.int32)
+        else:
+            bootstrap_indexes = rng.choice(
+                n_days, size=(self.n_bootstrap, n_days), p=proba
+            ).astype(np.int32)
+
+        return bootstrap_indexes, bootstrap_weights
+
+    @staticmethod
+    def warm_start_bounds(t, y):
+        """
+        Bounds of the parameters (x0, K, r) a warm start may start from for the days t
+        and values y, the midpoint within twice the observed days, the asymptote
+        within ten times the last value and a rate of at most one per day
+
+        Returns
+        -------
+        arrays of the lower and upper bounds
+        """
+        lower = np.zeros(3)
+        upper = np.array([2.0 * t.shape[0], 10.0 * max(np.max(y), 1.0), 1.0])
+
+        return lower, upper
+
+    def _start_params(self, t, y, init_params=None):
+        """
+        starting point of each bootstrap sample: the k-th parameters of init_params
+        if they are finite and within warm_start_bounds, the cold start otherwise, so
+        that a warm start never compounds a previous fit which did not converge or
+        drifted out of the data, and whether each sample is warm started
+        """
+        init = np.tile([max(t) / 2, max(y) / 2, 0.1], (self.n_bootstrap, 1))
+        warm = np.zeros(self.n_bootstrap, dtype=bool)
+        if init_params is None:
+            return init, warm
+
+        previous = np.array(
+            [_warm_start_params(init_params, k) for k in range(self.n_bootstrap)]
+        )
+        lower, upper = self.warm_start_bounds(t, y)
+        with np.errstate(invalid="ignore"):
+            warm = np.all((previous > lower) & (previous <= upper), axis=1)
+        init[warm] = previous[warm]
+        instrument.count("fit.cold_restarts", int(np.sum(~warm)))
+
+        return init, warm
+
+    def fit(self, X: pd.DataFrame, init_params=None):
         """
         Compute the optimum parameters to fit a generalized logistic function
         on the data and estimate the parameters distribution with boostrap
@@ -135,70 +916,155 @@ class SigmoidModel(BaseEstimator):
         Parameters
         ----------
         X : pd.DataFrame containing the values to fit
+        init_params : parameters distribution of a previous fit, the k-th bootstrap
+            sample is optimised starting from the k-th parameters, or from the cold
+            start if they are NaN or out of warm_start_bounds, default=None
+
         Returns
         -------
-        list of all parameters computed for each boostrap sample
+        list of all parameters computed for each boostrap sample,
+        matrix of shape (n_bootstrap, n_days) of the bootstrap indexes, or of the
+        number of draws of each day if bootstrap="weights"
 
         """
 
+        start = time.perf_counter()
+
         # --- Parameters to be optimized --- #
         params = {"x0": [], "K": [], "r": []}
-        bootstrap_indexes = []
+        n_evaluations = 0
+        n_iter = None
+        convergence = {"nfev": [], "njev": [], "success": []}
 
         # --- data used for the loss --- #
-        data = X.reset_index()
-        y = data.total_cases
-        t = data.index.values + 1
-
-        # --- begin bootstrap --- #
-        for k in range(self.n_bootstrap):
-
-            rng = np.random.RandomState()
-            index_value = data.index.values
-
-            # --- sample with a linear probability distribution if proba = True, uniform otherwise --- #
-
-            proba = [1 / index_value.shape[0] for _ in range(index_value.shape[0])]
-            if self.linear_proba:
-                proba = (index_value - np.min(index_value)) / np.sum(
-                    (index_value - np.min(index_value))
+        y = X.total_cases.to_numpy(dtype=float)
+        t = np.arange(1, y.shape[0] + 1)
+
+        rng = np.random.default_rng(self.random_state)
+        bootstrap_indexes, bootstrap_weights = self._draw_bootstrap(rng, y.shape[0])
+        init, warm = self._start_params(t, y, init_params)
+
+        if self.solver == "batched":
+            # --- fit every bootstrap sample at once, the warm started ones --- #
+            # --- stopping once their loss decreases by less than warm_start_tol --- #
+            tol = np.where(warm, self.warm_start_tol, 1e-10)
+            if self.bootstrap == "weights":
+                # --- every sample shares the original days --- #
+                fitted, rows_iter, converged = fit_sigmoid_batched(
+                    t[None, :],
+                    y[None, :],
+                    init,
+                    loss=self.loss,
+                    tol=tol,
+                    sample_weight=bootstrap_weights,
                 )
-
-            # --- bootstrap index --- #
-            index = rng.choice(y.shape[0], size=y.shape[0], p=proba)
-            bootstrap_indexes.append(index)
-
-            t_bootstrap = t[index]
-            y_bootstrap = y.iloc[index]
-
-            # --- loss function minimise (MSE) with x = (x0, K, r) --- #
-            if self.loss == "MSE":
-                loss = lambda x: np.mean((y_bootstrap - sigmoid(t_bootstrap, *x)) ** 2)
-
-            elif self.loss == "MAD":
-                loss = lambda x: np.mean(
-                    np.abs((y_bootstrap - sigmoid(t_bootstrap, *x)))
-                )
-
             else:
-                loss = lambda x: np.mean((y_bootstrap - sigmoid(t_bootstrap, *x)) ** 2)
-
-            # --- initial parameters --- #
+                fitted, rows_iter, converged = fit_sigmoid_batched(
+                    t[bootstrap_indexes],
+                    y[bootstrap_indexes],
+                    init,
+                    loss=self.loss,
+                    tol=tol,
+                )
+            n_evaluations, n_iter, convergence = _batched_convergence(
+                rows_iter, converged
+            )
 
-            x0 = (max(t) / 2, max(y) / 2, 0.1)
+            params["x0"] = fitted[:, 0].tolist()
+            params["K"] = fitted[:, 1].tolist()
+            params["r"] = fitted[:, 2].tolist()
 
-            # --- optimisation --- #
-            res = minimize(loss, x0, method="Nelder-Mead")
+        else:
+            from scipy.optimize import minimize
+
+            # --- begin bootstrap --- #
+            for k in range(self.n_bootstrap):
+
+                if self.bootstrap == "weights":
+                    # --- weighted loss on the original days --- #
+                    t_bootstrap = t
+                    y_bootstrap = y
+                    weight = bootstrap_weights[k] / y.shape[0]
+                else:
+                    t_bootstrap = t[bootstrap_indexes[k]]
+                    y_bootstrap = y[bootstrap_indexes[k]]
+                    weight = np.full(y.shape[0], 1 / y.shape[0])
+
+                # --- loss function minimise (MSE or MAD) with x = (x0, K, r), --- #
+                # --- computed by a fused kernel compiled with numba if installed --- #
+                mad = self.loss == "MAD"
+                loss = lambda x: kernels.sigmoid_loss(
+                    t_bootstrap, y_bootstrap, weight, x[0], x[1], x[2], mad
+                )
 
-            params["x0"].append(res["x"][0])
-            params["K"].append(res["x"][1])
-            params["r"].append(res["x"][2])
+                # --- initial parameters --- #
+
+                if self.solver == "least-squares" and self.loss != "MAD":
+                    xtol = self.warm_start_tol if warm[k] else 1e-8
+                    res = fit_sigmoid_least_squares(
+                        t_bootstrap, y_bootstrap, init[k], weight, xtol=xtol
+                    )
+                    x = res["x"]
+
+                elif not warm[k]:
+                    # --- optimisation --- #
+                    res = minimize(loss, init[k], method="Nelder-Mead")
+                    x = res["x"]
+
+                else:
+                    # --- optimise relatively to the previous fit and stop once stabilized --- #
+                    x_init = init[k]
+                    res = minimize(
+                        lambda u: loss(u * x_init),
+                        np.ones(3),
+                        method="Nelder-Mead",
+                        options={
+                            "initial_simplex": np.vstack(
+                                [np.ones(3), np.ones(3) + 0.05 * np.eye(3)]
+                            ),
+                            "xatol": self.warm_start_tol,
+                            "fatol": self.warm_start_tol * loss(x_init),
+                        },
+                    )
+                    x = res["x"] * x_init
+
+                n_evaluations += res["nfev"]
+                convergence["nfev"].append(int(res["nfev"]))
+                convergence["njev"].append(int(res.get("njev") or 0))
+                convergence["success"].append(bool(res["success"]))
+
+                params["x0"].append(x[0])
+                params["K"].append(x[1])
+                params["r"].append(x[2])
 
         self.params = params
         self.bootstrap_indexes = bootstrap_indexes
+        self.bootstrap_weights = bootstrap_weights
+        self.n_evaluations = n_evaluations
+        self.convergence = convergence
+        self._record_fit(y.shape[0], time.perf_counter() - start, n_iter)
+
+        if self.bootstrap == "weights":
+            return params, bootstrap_weights
 
         return params, bootstrap_indexes
 
+    def _record_fit(self, n_days, wall_time_s, n_iter=None):
+        """add the statistics of the last fit to the active run report, if any"""
+        instrument.count("fit.calls")
+        instrument.count("fit.n_evaluations", self.n_evaluations)
+        instrument.record(
+            "fit",
+            model=type(self).__name__,
+            solver=getattr(self, "solver", None),
+            n_days=n_days,
+            n_bootstrap=self.n_bootstrap,
+            wall_time_s=wall_time_s,
+            n_evaluations=self.n_evaluations,
+            n_iter=n_iter,
+            **self.convergence_summary(),
+        )
+
     def predict(self, t_pred, X):
         """
         Compute the model predictions with for each quantile 25%, 50% and 75% of the parameter K
@@ -212,48 +1078,79 @@ class SigmoidModel(BaseEstimator):
         -------
         fitted_sigmoid DataFrame containing all
         """
-        quantiles = {
-            "25%": [0.5, 0.25, 0.5],
-            "median": [0.5, 0.5, 0.5],
-            "75%": [0.5, 0.75, 0.5],
-        }
-
-        fitted_sigmoid_df = pd.DataFrame()
-        paramters_values_sigmoid = pd.DataFrame()
+        # --- all quantile curves are evaluated in a single broadcast --- #
+        values, derivative, quantiles = self.predict_quantiles(
+            [_stack_params(self.params)], np.zeros(t_pred.shape[0], dtype=int), t_pred
+        )
 
         t_pred_date = pd.date_range(
             start=X.date.iloc[0], freq="d", periods=t_pred.shape[0]
         )
 
-        fitted_sigmoid_df["date"] = t_pred_date
-        fitted_sigmoid_df["date_str"] = fitted_sigmoid_df.date.apply(
-            lambda x: x.strftime("%d/%m/%Y")
+        fitted_sigmoid_df = _prediction_frame(t_pred_date, values, derivative)
+
+        # --- keep parameters values of each quantiles --- #
+        paramters_values_sigmoid = pd.DataFrame(
+            quantiles[0].T, columns=list(PREDICTION_QUANTILES)
         )
 
-        for quantile, quantile_params in quantiles.items():
-            # --- get the quantiles of parameters computed via bootstrap ---#
-            x0, K, r = [
-                np.quantile(list(self.params.values())[i], quantile_params[i])
-                for i in range(len(quantile_params))
-            ]
+        return fitted_sigmoid_df, paramters_values_sigmoid
 
-            # --- use the parameters to compute the values of the fitted sigmoid --- #
-            fitted_sigmoid_df[quantile] = sigmoid(t_pred, x0, K, r)
+    @classmethod
+    def predict_quantiles(cls, params, row_window, t):
+        """
+        Compute the curves of PREDICTION_QUANTILES of several fits on the days of each fit
 
-            # --- keep parameters values of each quantiles --- #
-            paramters_values_sigmoid[quantile] = [x0, K, r]
+        Parameters
+        ----------
+        params : list of arrays of shape (n_bootstrap, 3) of the bootstrap parameters
+            of each fit
+        row_window : fit of each predicted row, rows sorted by fit
+        t : day of each predicted row
 
-        fitted_sigmoid_df["derivative"] = (
-            np.quantile(self.params["r"], 0.5)
-            * fitted_sigmoid_df["median"]
-            * (1 - fitted_sigmoid_df["median"] / np.quantile(self.params["K"], 0.5))
-        )
+        Returns
+        -------
+        array of shape (n_rows, n_quantiles) of the values of each curve,
+        array of shape (n_rows,) of the derivative of the median curve,
+        array of shape (n_fits, n_quantiles, 3) of the parameters of each curve
+        """
+        # --- get the quantiles of parameters computed via bootstrap ---#
+        quantiles = _stack_by_bootstrap(params, quantile_params)
 
-        fitted_sigmoid_df["median_display"] = fitted_sigmoid_df["median"].apply(
-            lambda x: "{:,}".format(int(x))
-        )
+        row_params = quantiles[row_window]
+        x0, K, r = row_params[:, :, 0], row_params[:, :, 1], row_params[:, :, 2]
+        values = sigmoid(np.asarray(t, dtype=float)[:, None], x0, K, r)
 
-        return fitted_sigmoid_df, paramters_values_sigmoid
+        median_index = list(PREDICTION_QUANTILES).index("median")
+        median = values[:, median_index]
+        derivative = r[:, median_index] * median * (1 - median / K[:, median_index])
+
+        return values, derivative, quantiles
+
+    def convergence_summary(self):
+        """
+        Summarize the convergence of the bootstrap fits of the last call to .fit, a
+        fit of the "batched" solver evaluates the loss once per iteration and the
+        jacobian once per iteration but the last
+
+        Returns
+        -------
+        dictionary with the number of fits, the share of converged fits and the mean
+        and maximum number of loss and jacobian evaluations per fit
+        """
+        if not self.convergence.get("nfev"):
+            return {}
+
+        nfev = np.array(self.convergence["nfev"])
+        njev = np.array(self.convergence["njev"])
+
+        return {
+            "n_fits": int(nfev.shape[0]),
+            "success_rate": float(np.mean(self.convergence["success"])),
+            "mean_nfev": float(nfev.mean()),
+            "max_nfev": int(nfev.max()),
+            "mean_njev": float(njev.mean()),
+        }
 
     def plot_params_distribution(self, height=3.5, **plot_kws):
         """
@@ -263,6 +1160,8 @@ class SigmoidModel(BaseEstimator):
         -------
         matplotlib figure
         """
+        import seaborn as sns
+
         param_df = pd.DataFrame(data=self.params)
         figure = sns.pairplot(
             param_df, diag_kind="kde", height=height, plot_kws=plot_kws
@@ -271,6 +1170,423 @@ class SigmoidModel(BaseEstimator):
         return figure
 
 
+class TwoModeGrowthModel(SigmoidModel):
+    """
+    Bootstrap fit of two_mode_growth with the containment indicator y = 1 from t1
+    on, an exponential growth until t1 continued by a generalized logistic growth,
+    see containment_growth, with the fit, predict and plot_params_distribution
+    methods of SigmoidModel. The bounds and starting points are derived from the
+    data. All starting points of all bootstrap samples are fitted at once with a
+    bounded vectorized Levenberg-Marquardt using the analytic jacobian, the worse
+    half of the starts of each bootstrap sample being dropped every screen_iter
+    iterations until a single one is left.
+
+    Parameters
+    ----------
+    n_bootstrap : Number of boostrap to estimate the distribution of the fitted parameters
+    linear_proba : Whether or not to apply linear importance of the most recent values, default=True
+    loss : "MSE" or "MAD", default="MSE"
+    random_state : seed of the bootstrap sampling and of the starting points, default=None
+    bootstrap : "resample" or "weights", see SigmoidModel, default="resample"
+    n_starts : number of starting points of each bootstrap sample, default=4
+    max_iter : maximum number of Levenberg-Marquardt iterations of the best start,
+        default=200
+    screen_iter : number of iterations of each round of screening of the starts,
+        default=3
+    tol : relative decrease of the loss under which a fit is considered converged,
+        default=1e-6
+    """
+
+    param_names = ["x0", "K", "r1", "r2", "t1"]
+
+    # --- bootstrap quantile of the curves in each column of PREDICTION_QUANTILES --- #
+    curve_levels = [0.25, 0.5, 0.75]
+
+    def __init__(
+        self,
+        n_bootstrap=100,
+        linear_proba=True,
+        loss="MSE",
+        random_state=None,
+        bootstrap="resample",
+        n_starts=4,
+        max_iter=200,
+        screen_iter=3,
+        tol=1e-6,
+    ):
+        super().__init__(
+            n_bootstrap=n_bootstrap,
+            linear_proba=linear_proba,
+            loss=loss,
+            solver="batched",
+            random_state=random_state,
+            bootstrap=bootstrap,
+        )
+        self.n_starts = n_starts
+        self.max_iter = max_iter
+        self.screen_iter = screen_iter
+        self.tol = tol
+
+    @staticmethod
+    def _growth_rates(t, y):
+        """rate of the exponential growth from 1 on day 0 to the value of each day"""
+        return np.log(np.maximum(y, 1.0)) / t
+
+    @classmethod
+    def bounds(cls, t, y):
+        """
+        Bounds of the parameters (x0, K, r1, r2, t1) for the days t and values y, the
+        containment t1 is one of the observed days and the rate r1 is at most twice
+        the growth rate of the data after the first week
+
+        Returns
+        -------
+        arrays of the lower and upper bounds
+        """
+        n_days = t.shape[0]
+        y_max = max(np.max(y), 1.0)
+        rates = cls._growth_rates(t, y)[t >= min(7, n_days)]
+
+        lower = np.array([1.0, 0.0, 0.0, 0.0, 1.0])
+        upper = np.array(
+            [
+                2.0 * n_days,
+                10.0 * y_max,
+                # --- exp(r1 * t1) stays finite --- #
+                min(2.0 * np.max(rates), 700.0 / n_days),
+                1.0,
+                n_days,
+            ]
+        )
+
+        return lower, upper
+
+    def _initial_params(self, rng, t, y):
+        """
+        draw the n_starts starting points shared by all bootstrap samples, with the
+        containment within the first half of the observed days and the rate of the
+        exponential growth reaching the value of that day
+        """
+        n_days = t.shape[0]
+        n_starts = self.n_starts
+        t1 = np.ceil(rng.uniform(0.05, 0.5, n_starts) * n_days)
+
+        return np.column_stack(
+            [
+                rng.uniform(0.3, 1.2, n_starts) * n_days,
+                rng.uniform(0.5, 2.0, n_starts) * max(np.max(y), 1.0),
+                self._growth_rates(t1, y[t1.astype(int) - 1]),
+                rng.uniform(0.02, 0.3, n_starts),
+                t1,
+            ]
+        )
+
+    def fit(self, X: pd.DataFrame, init_params=None):
+        """
+        Compute the optimum parameters to fit containment_growth on the data and
+        estimate the parameters distribution with boostrap
+
+        Parameters
+        ----------
+        X : pd.DataFrame containing the values to fit
+        init_params : parameters distribution of a previous fit, the k-th bootstrap
+            sample is then optimised from the k-th parameters only, clipped to the
+            bounds, or from the first cold start if they are NaN, default=None
+
+        Returns
+        -------
+        list of all parameters computed for each boostrap sample,
+        matrix of shape (n_bootstrap, n_days) of the bootstrap indexes, or of the
+        number of draws of each day if bootstrap="weights"
+        """
+        start = time.perf_counter()
+
+        y = X.total_cases.to_numpy(dtype=float)
+        t = np.arange(1, y.shape[0] + 1)
+        n_params = len(self.param_names)
+
+        rng = np.random.default_rng(self.random_state)
+        bootstrap_indexes, bootstrap_weights = self._draw_bootstrap(rng, y.shape[0])
+        lower, upper = self.bounds(t, y)
+
+        # --- starting points of shape (n_bootstrap, n_starts, n_params) --- #
+        if init_params is None:
+            starts = np.broadcast_to(
+                self._initial_params(rng, t, y)[None],
+                (self.n_bootstrap, self.n_starts, n_params),
+            )
+        else:
+            # --- a sample whose previous fit did not converge starts cold --- #
+            previous = np.array(
+                [_warm_start_params(init_params, k) for k in range(self.n_bootstrap)]
+            )
+            warm = np.all(np.isfinite(previous), axis=1, keepdims=True)
+            starts = np.where(warm, previous, self._initial_params(rng, t, y)[0])
+            starts = starts[:, None, :]
+        starts = np.clip(starts, lower, upper)
+
+        def fit_rows(init, n_repeat, max_iter):
+            # --- every row of init is fitted at once, n_repeat rows per sample --- #
+            sample_weight = None
+            if self.bootstrap == "weights":
+                t_fit, y_fit = t[None, :], y[None, :]
+                sample_weight = np.repeat(bootstrap_weights, n_repeat, axis=0)
+            else:
+                index = np.repeat(bootstrap_indexes, n_repeat, axis=0)
+                t_fit, y_fit = t[index], y[index]
+
+            return fit_curve_batched(
+                containment_growth_curve,
+                kernels.containment_growth_jacobian,
+                t_fit,
+                y_fit,
+                init.reshape(-1, n_params),
+                loss=self.loss,
+                max_iter=max_iter,
+                tol=self.tol,
+                sample_weight=sample_weight,
+                bounds=(lower, upper),
+            )
+
+        # --- the worse half of the starts of each sample is dropped after --- #
+        # --- every round of screen_iter iterations                         --- #
+        n_evaluations = 0
+        while starts.shape[1] > 1:
+            n_starts = starts.shape[1]
+            screened, n_iter, cost, _ = fit_rows(starts, n_starts, self.screen_iter)
+            n_evaluations += int(np.sum(n_iter + 1))
+
+            best = np.argsort(cost.reshape(self.n_bootstrap, n_starts), axis=1)
+            starts = screened.reshape(self.n_bootstrap, n_starts, n_params)[
+                np.arange(self.n_bootstrap)[:, None], best[:, : n_starts // 2]
+            ]
+
+        fitted, n_iter, _, converged = fit_rows(starts, 1, self.max_iter)
+        n_final, n_iter, convergence = _batched_convergence(n_iter, converged)
+        n_evaluations += n_final
+
+        params = {
+            name: fitted[:, i].tolist() for i, name in enumerate(self.param_names)
+        }
+
+        self.params = params
+        self.bootstrap_indexes = bootstrap_indexes
+        self.bootstrap_weights = bootstrap_weights
+        self.n_evaluations = n_evaluations
+        self.convergence = convergence
+        self._record_fit(y.shape[0], time.perf_counter() - start, n_iter)
+
+        if self.bootstrap == "weights":
+            return params, bootstrap_weights
+
+        return params, bootstrap_indexes
+
+    @classmethod
+    def predict_quantiles(cls, params, row_window, t):
+        """
+        Compute the bootstrap quantiles of the curves of several fits on the days of
+        each fit, see SigmoidModel.predict_quantiles
+
+        Returns
+        -------
+        array of shape (n_rows, n_quantiles) of the quantiles of the curves,
+        array of shape (n_rows,) of the median derivative of the curves,
+        array of shape (n_fits, n_quantiles, 5) of the quantiles of each parameter
+        """
+        t = np.asarray(t, dtype=float)
+        values = np.empty((t.shape[0], len(cls.curve_levels)))
+        derivative = np.empty(t.shape[0])
+
+        # --- the rows of a fit are contiguous, its bootstrap curves are broadcast --- #
+        fit_bounds = np.searchsorted(row_window, np.arange(len(params) + 1))
+        for k, fit_params in enumerate(params):
+            rows = slice(fit_bounds[k], fit_bounds[k + 1])
+            columns = _split_params(np.asarray(fit_params, dtype=float))
+
+            curves = containment_growth(t[None, rows], *columns)
+            values[rows] = np.quantile(curves, cls.curve_levels, axis=0).T
+            derivative[rows] = np.median(
+                containment_growth_derivative(t[None, rows], *columns), axis=0
+            )
+
+        quantiles = _stack_by_bootstrap(
+            params,
+            lambda p: np.moveaxis(np.quantile(p, cls.curve_levels, axis=1), 0, 1),
+        )
+
+        return values, derivative, quantiles
+
+
+def _spawn_seeds(random_state, n_seeds):
+    """derive n_seeds independent seeds from random_state, None if random_state is None"""
+    if random_state is None:
+        return [None] * n_seeds
+
+    return [
+        int(seed.generate_state(1)[0])
+        for seed in np.random.SeedSequence(random_state).spawn(n_seeds)
+    ]
+
+
+# --- code the parameters fitted by SigmoidModel and TwoModeGrowthModel depend on, --- #
+# --- with the classes of the model it is part of the key of a cached fit          --- #
+FIT_CODE = [
+    sigmoid,
+    sigmoid_jacobian,
+    fit_sigmoid_batched,
+    fit_curve_batched,
+    _solve_batched,
+    _batched_convergence,
+    fit_sigmoid_least_squares,
+    _rows,
+    _split_params,
+    sigmoid_curve,
+    two_mode_growth,
+    containment_growth,
+    containment_growth_derivative,
+    containment_growth_curve,
+    _warm_start_params,
+    _spawn_seeds,
+    kernels,
+]
+
+
+def _moving_windows(X: pd.DataFrame, step, min_data):
+    """yield the end index and the training subset of each moving window"""
+    n = X.shape[0]
+
+    for k in range((n - min_data) // step + 1):
+        end_data_index = min_data + step * k
+        if k == (n - min_data) // step:
+            # Take all data
+            yield X.shape[0], X
+        else:
+            # Take a subset
+            yield end_data_index, X.iloc[:end_data_index, :]
+
+
+def _fit_windows(tasks, seeds, warm_start=False, cache=None):
+    """
+    fit a model on each (X_train, n_prediction, model, model_kwargs) task and return
+    its bootstrap parameters, first and last training dates and number of predicted
+    days, seeding each fit with the previous one if warm_start is True and reusing
+    the fits already stored in cache
+    """
+    results = []
+    init_params = None
+    n_stored = 0
+
+    for (X_train, n_prediction, model, model_kwargs), seed in zip(tasks, seeds):
+        sigmoid_model = model(random_state=seed, **model_kwargs)
+
+        cached = None
+        if cache is not None:
+            key = cache.key(X_train, sigmoid_model, init_params)
+            cached = cache.get(key)
+
+        if cached is not None:
+            sigmoid_model.params, success = cached
+            instrument.count("fit.cached")
+        else:
+            sigmoid_model.fit(X_train, init_params=init_params)
+            success = sigmoid_model.convergence.get("success")
+            if cache is not None:
+                cache.set(key, sigmoid_model.params, success)
+                n_stored += 1
+
+        results.append(
+            (
+                _stack_params(sigmoid_model.params),
+                X_train.date.iloc[0],
+                X_train.date.iloc[-1],
+                n_prediction - 1,
+            )
+        )
+
+        if warm_start:
+            init_params = _converged_params(sigmoid_model.params, success)
+
+    # --- the directory of the cache is scanned once for all the stored fits --- #
+    if n_stored:
+        cache.evict()
+
+    return results
+
+
+def _iter_chains(chains, seeds, warm_start, n_jobs, cache=None, batch_size=None):
+    """
+    fit each chain of tasks in a pool of processes and yield the result of each
+    window in order, once its batch of batch_size chains is fitted
+    """
+    chain_seeds = []
+    for chain in chains:
+        chain_seeds.append(seeds[: len(chain)])
+        seeds = seeds[len(chain) :]
+
+    if batch_size is None:
+        batch_size = max(len(chains), 1)
+
+    from joblib import Parallel, delayed
+
+    # --- the pool of processes is kept alive between the batches --- #
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, len(chains), batch_size):
+            results = parallel(
+                delayed(_fit_windows)(chain, chain_seed, warm_start, cache)
+                for chain, chain_seed in zip(
+                    chains[start : start + batch_size],
+                    chain_seeds[start : start + batch_size],
+                )
+            )
+            for chain_results in results:
+                yield from chain_results
+
+
+def _run_chains(chains, seeds, warm_start, n_jobs, cache=None):
+    """fit each chain of tasks in a pool of processes and flatten the results"""
+    return list(_iter_chains(chains, seeds, warm_start, n_jobs, cache))
+
+
+def _moving_tasks(
+    X: pd.DataFrame,
+    n_prediction,
+    step=5,
+    min_data=10,
+    n_bootstrap=10,
+    linear_proba=False,
+    loss="MSE",
+    verbose=False,
+    solver="nelder-mead",
+    bootstrap="resample",
+    model=None,
+):
+    """
+    list the (X_train, n_prediction, model, model_kwargs) fits of
+    compute_moving_predictions, keeping the keyword arguments accepted by model
+    """
+    model = SigmoidModel if model is None else model
+    model_kwargs = dict(
+        n_bootstrap=n_bootstrap,
+        linear_proba=linear_proba,
+        loss=loss,
+        solver=solver,
+        bootstrap=bootstrap,
+    )
+    model_kwargs = {
+        key: value
+        for key, value in model_kwargs.items()
+        if key in model._get_param_names()
+    }
+
+    tasks = []
+    for end_data_index, X_train in _moving_windows(X, step, min_data):
+        if verbose:
+            print(f"index values from 0 to {end_data_index}")
+        tasks.append((X_train, n_prediction, model, model_kwargs))
+
+    return tasks
+
+
 def compute_moving_predictions(
     X: pd.DataFrame,
     n_prediction,
@@ -280,43 +1596,543 @@ def compute_moving_predictions(
     linear_proba=False,
     loss="MSE",
     verbose=False,
+    solver="nelder-mead",
+    n_jobs=1,
+    random_state=None,
+    warm_start=False,
+    cache=None,
+    bootstrap="resample",
+    model=None,
 ):
-    fitted_sigmoid_moving = pd.DataFrame()
-    paramters_values_moving = pd.DataFrame()
+    """
+    Fit a SigmoidModel on moving training windows and compute their predictions
 
-    n = X.shape[0]
+    Parameters
+    ----------
+    X : pd.DataFrame containing the values to fit
+    n_prediction : number of days predicted from the first day of X
+    step : number of days between two training windows
+    min_data : number of days of the first training window
+    n_jobs : number of processes fitting the windows in parallel, -1 to use all cores
+    random_state : seed from which the seed of each window is derived, default=None
+    warm_start : whether or not to start each window optimisation from the parameters
+        fitted on the previous window, windows are then fitted sequentially, default=False
+    cache : FitCache from which already computed windows are read, default=None
+    bootstrap : "resample" or "weights", bootstrap mode of SigmoidModel, default="resample"
+    model : class of the fitted model, SigmoidModel or TwoModeGrowthModel, the arguments
+        it does not accept are ignored, default=SigmoidModel
 
-    for k in range((n - min_data) // step + 1):
-        sigmoid_model = SigmoidModel(
-            n_bootstrap=n_bootstrap, linear_proba=linear_proba, loss=loss
+    Returns
+    -------
+    predictions and parameters of every window
+    """
+    tasks = _moving_tasks(
+        X,
+        n_prediction,
+        step,
+        min_data,
+        n_bootstrap,
+        linear_proba,
+        loss,
+        verbose,
+        solver,
+        bootstrap,
+        model,
+    )
+    seeds = _spawn_seeds(random_state, len(tasks))
+    chains = [tasks] if warm_start else [[task] for task in tasks]
+
+    results = _run_chains(chains, seeds, warm_start, n_jobs, cache)
+
+    return predict_windows(*zip(*results), model=model)
+
+
+def iter_moving_predictions(
+    X: pd.DataFrame,
+    n_prediction,
+    n_jobs=1,
+    random_state=None,
+    warm_start=False,
+    cache=None,
+    batch_size=None,
+    **kwargs,
+):
+    """
+    Fit a SigmoidModel on moving training windows and yield the predictions of each
+    window once it is fitted, windows are yielded in the order of compute_moving_predictions
+    and with the same results
+
+    Parameters
+    ----------
+    X : pd.DataFrame containing the values to fit
+    n_prediction : number of days predicted from the first day of X
+    n_jobs : number of processes fitting the windows in parallel, -1 to use all cores
+    random_state : seed from which the seed of each window is derived, default=None
+    warm_start : whether or not to start each window optimisation from the parameters
+        fitted on the previous window, default=False
+    cache : FitCache from which already computed windows are read, default=None
+    batch_size : number of windows fitted by the pool of processes between two
+        yields, default=number of processes
+    kwargs : other keyword arguments of compute_moving_predictions
+
+    Yields
+    ------
+    predictions and parameters of a window
+    """
+    tasks = _moving_tasks(X, n_prediction, **kwargs)
+    seeds = _spawn_seeds(random_state, len(tasks))
+    chains = [tasks] if warm_start else [[task] for task in tasks]
+
+    if batch_size is None:
+        from joblib import effective_n_jobs
+
+        batch_size = effective_n_jobs(n_jobs)
+
+    for result in _iter_chains(chains, seeds, warm_start, n_jobs, cache, batch_size):
+        yield predict_windows(*zip(result), model=kwargs.get("model"))
+
+
+def compute_countries_predictions(
+    country_kwargs: dict,
+    n_jobs=1,
+    random_state=None,
+    warm_start=False,
+    cache=None,
+    **kwargs,
+):
+    """
+    Run compute_moving_predictions for several countries, fitting every
+    (country, window) pair in a single pool of processes
+
+    Parameters
+    ----------
+    country_kwargs : dictionary {location: keyword arguments of compute_moving_predictions
+        specific to the location, at least X and n_prediction}
+    n_jobs : number of processes fitting the windows in parallel, -1 to use all cores
+    random_state : seed from which the seed of each (country, window) is derived, default=None
+    warm_start : whether or not to warm start the windows of each country, countries
+        are then fitted in parallel but their windows sequentially, default=False
+    cache : FitCache from which already computed windows are read, default=None
+    kwargs : keyword arguments of compute_moving_predictions shared by all locations,
+        the model class must be given here
+
+    Returns
+    -------
+    predictions and parameters of every country and window with a location column
+    """
+    locations, chains = _countries_chains(country_kwargs, warm_start, **kwargs)
+    seeds = _spawn_seeds(random_state, len(locations))
+
+    results = _run_chains(chains, seeds, warm_start, n_jobs, cache)
+
+    return _predict_countries(locations, results, kwargs.get("model"))
+
+
+def _predict_countries(locations, results, model=None):
+    """compute the predictions of every (country, window) result with a location column"""
+    fitted_sigmoid_all, paramters_values_all = predict_windows(
+        *zip(*results), model=model
+    )
+
+    n_days = [n_day for _, _, _, n_day in results]
+    n_params = [window_params.shape[1] for window_params, _, _, _ in results]
+    fitted_sigmoid_all["location"] = np.repeat(locations, n_days)
+    paramters_values_all["location"] = np.repeat(locations, n_params)
+
+    return fitted_sigmoid_all, paramters_values_all
+
+
+def iter_countries_predictions(
+    country_kwargs: dict,
+    n_jobs=1,
+    random_state=None,
+    warm_start=False,
+    cache=None,
+    batch_size=None,
+    **kwargs,
+):
+    """
+    Fit the moving training windows of several countries and yield the predictions
+    of each (country, window) once it is fitted, in the order and with the results
+    of compute_countries_predictions
+
+    Parameters
+    ----------
+    country_kwargs : dictionary {location: keyword arguments of compute_moving_predictions
+        specific to the location, at least X and n_prediction}
+    n_jobs : number of processes fitting the windows in parallel, -1 to use all cores
+    random_state : seed from which the seed of each (country, window) is derived, default=None
+    warm_start : whether or not to warm start the windows of each country, default=False
+    cache : FitCache from which already computed windows are read, default=None
+    batch_size : number of windows, or of countries if warm_start, fitted by the pool
+        of processes between two yields, default=number of processes
+    kwargs : keyword arguments of compute_moving_predictions shared by all locations,
+        the model class must be given here
+
+    Yields
+    ------
+    location, predictions and parameters of a window with a location column
+    """
+    locations, chains = _countries_chains(country_kwargs, warm_start, **kwargs)
+    seeds = _spawn_seeds(random_state, len(locations))
+
+    if batch_size is None:
+        from joblib import effective_n_jobs
+
+        batch_size = effective_n_jobs(n_jobs)
+
+    results = _iter_chains(chains, seeds, warm_start, n_jobs, cache, batch_size)
+    for location, result in zip(locations, results):
+        fitted_sigmoid, paramters_values = predict_windows(
+            *zip(result), model=kwargs.get("model")
         )
+        fitted_sigmoid["location"] = location
+        paramters_values["location"] = location
 
-        end_data_index = min_data + step * k
-        if k == (n - min_data) // step:
-            # Take all data
-            X_train = X
-            end_data_index = X.shape[0]
+        yield location, fitted_sigmoid, paramters_values
+
+
+def _countries_chains(country_kwargs: dict, warm_start=False, **kwargs):
+    """
+    list the location of every task of compute_countries_predictions and the chains
+    of tasks fitted sequentially, one per country if warm_start, one per task otherwise
+    """
+    locations = []
+    chains = []
+    for location, location_kwargs in country_kwargs.items():
+        location_tasks = _moving_tasks(**{**kwargs, **location_kwargs})
+        locations += [location] * len(location_tasks)
+        if warm_start:
+            chains.append(location_tasks)
         else:
-            # Take a subset
-            X_train = X.iloc[:end_data_index, :]
+            chains += [[task] for task in location_tasks]
 
-        if verbose:
-            print(f"index values from 0 to {end_data_index}")
+    return locations, chains
+
+
+def panel_country_kwargs(
+    data, n_windows=11, min_days=20, min_count_total=15, n_days_prediction=300
+):
+    """
+    Build the country_kwargs of compute_panel_predictions for every location of the
+    dataset filtered with get_min_count
+
+    Parameters
+    ----------
+    data : Covid 19 dataset or LocationIndex
+    n_windows : number of training windows of each location, the last one ending on
+        the last day of the location
+    min_days : minimum number of days of the first training window, locations with
+        fewer days are left out
+    min_count_total : minimum number of total cases of the first day of a location
+    n_days_prediction : number of days predicted after the last day of a location
 
-        t_pred_end = X_train.date.iloc[-1]
-        t_pred = np.arange(1, n_prediction, 1)
-        fitted_params, _ = sigmoid_model.fit(X_train)
-        fitted_sigmoid_df, paramters_values_sigmoid = sigmoid_model.predict(
-            t_pred, X_train
+    Returns
+    -------
+    dictionary {location: keyword arguments of compute_moving_predictions}
+    """
+    country_kwargs = {}
+    for location, X in get_min_count(data, min_count_total).groupby(
+        "location", sort=False
+    ):
+        min_data = X.shape[0] - n_windows + 1
+        if min_data < min_days:
+            continue
+
+        country_kwargs[location] = dict(
+            X=X, n_prediction=X.shape[0] + n_days_prediction, min_data=min_data
         )
 
-        fitted_sigmoid_df["date_end_train"] = np.repeat(
-            t_pred_end, repeats=fitted_sigmoid_df.shape[0]
+    return country_kwargs
+
+
+def _pad_rows(rows, n_days, fill):
+    """stack arrays of shape (n_rows, n) with n <= n_days padded with fill on the right"""
+    return np.vstack(
+        [
+            np.pad(row, ((0, 0), (0, n_days - row.shape[1])), constant_values=fill)
+            for row in rows
+        ]
+    )
+
+
+def _fit_panel_chunk(tasks, models):
+    """
+    fit the bootstrap samples of the (X_train, n_prediction, model, model_kwargs)
+    tasks together with fit_sigmoid_batched and set the params of their models
+    """
+    start = time.perf_counter()
+    t_rows, y_rows, weight_rows, init_rows = [], [], [], []
+    for (X_train, _, _, _), sigmoid_model in zip(tasks, models):
+        y = X_train.total_cases.to_numpy(dtype=float)
+        t = np.arange(1, y.shape[0] + 1)
+
+        # --- same bootstrap samples and initial parameters as SigmoidModel.fit --- #
+        rng = np.random.default_rng(sigmoid_model.random_state)
+        indexes, weights = sigmoid_model._draw_bootstrap(rng, y.shape[0])
+        sigmoid_model.bootstrap_indexes = indexes
+        sigmoid_model.bootstrap_weights = weights
+
+        if sigmoid_model.bootstrap == "weights":
+            t_rows.append(np.tile(t, (sigmoid_model.n_bootstrap, 1)))
+            y_rows.append(np.tile(y, (sigmoid_model.n_bootstrap, 1)))
+            weight_rows.append(weights)
+        else:
+            t_rows.append(t[indexes])
+            y_rows.append(y[indexes])
+            weight_rows.append(np.ones(indexes.shape))
+        init_rows.append(
+            np.tile([max(t) / 2, max(y) / 2, 0.1], (sigmoid_model.n_bootstrap, 1))
         )
 
-        fitted_sigmoid_moving = pd.concat([fitted_sigmoid_moving, fitted_sigmoid_df])
-        paramters_values_moving = pd.concat(
-            [paramters_values_moving, paramters_values_sigmoid]
+    n_days = max(X_train.shape[0] for X_train, _, _, _ in tasks)
+    fitted, n_iter, converged = fit_sigmoid_batched(
+        _pad_rows(t_rows, n_days, 1),
+        _pad_rows(y_rows, n_days, 0),
+        np.vstack(init_rows),
+        loss=models[0].loss,
+        sample_weight=_pad_rows(weight_rows, n_days, 0),
+    )
+
+    # --- split the fitted parameters between the tasks of the chunk --- #
+    wall_time_s = time.perf_counter() - start
+    row_bounds = np.cumsum(
+        [0] + [sigmoid_model.n_bootstrap for sigmoid_model in models]
+    )
+    for (X_train, _, _, _), sigmoid_model, first_row, end_row in zip(
+        tasks, models, row_bounds[:-1], row_bounds[1:]
+    ):
+        rows = slice(first_row, end_row)
+        sigmoid_model.params = {
+            name: fitted[rows, i].tolist() for i, name in enumerate(["x0", "K", "r"])
+        }
+        n_evaluations, task_n_iter, convergence = _batched_convergence(
+            n_iter[rows], converged[rows]
         )
+        sigmoid_model.n_evaluations = n_evaluations
+        sigmoid_model.convergence = convergence
+        sigmoid_model._record_fit(
+            X_train.shape[0],
+            wall_time_s * (end_row - first_row) / fitted.shape[0],
+            task_n_iter,
+        )
+
+    instrument.record(
+        "fit_panel_chunk",
+        n_fits=len(tasks),
+        n_rows=fitted.shape[0],
+        n_days=n_days,
+        wall_time_s=wall_time_s,
+        n_evaluations=int(np.sum(n_iter + 1)),
+        n_iter=int(np.max(n_iter)),
+        n_converged=int(np.sum(converged)),
+    )
 
-    return fitted_sigmoid_moving, paramters_values_moving
+
+def _iter_panel(tasks, seeds, cache=None, max_cells=100_000, skip_failed=False):
+    """
+    fit the SigmoidModel tasks of compute_countries_predictions with the batched
+    solver and yield the index and the _fit_windows result of each task once it is
+    fitted, the cached tasks first. The bootstrap samples of all tasks are fitted
+    together by chunks of at most max_cells (sample, day) pairs, each sample padded
+    with zero weight days to the longest series of its chunk. The tasks of a chunk
+    whose fit fails are fitted again one by one, a task failing on its own is
+    yielded with None if skip_failed and raises otherwise
+    """
+    models = []
+
+    def result(k):
+        X_train, n_prediction, _, _ = tasks[k]
+        return (
+            _stack_params(models[k].params),
+            X_train.date.iloc[0],
+            X_train.date.iloc[-1],
+            n_prediction - 1,
+        )
+
+    pending = []
+    for k, ((X_train, _, model, model_kwargs), seed) in enumerate(zip(tasks, seeds)):
+        if model is not SigmoidModel:
+            raise ValueError("panel fitting is only available for SigmoidModel")
+
+        sigmoid_model = SigmoidModel(
+            random_state=seed, **{**model_kwargs, "solver": "batched"}
+        )
+        models.append(sigmoid_model)
+
+        if cache is not None:
+            cached = cache.get(cache.key(X_train, sigmoid_model))
+            if cached is not None:
+                sigmoid_model.params = cached[0]
+                instrument.count("fit.cached")
+                yield k, result(k)
+                continue
+
+        pending.append(k)
+
+    # --- series of similar length are fitted together to limit the padding --- #
+    pending.sort(key=lambda k: (models[k].loss, tasks[k][0].shape[0]))
+
+    chunks = []
+    for k in pending:
+        n_cells = models[k].n_bootstrap * tasks[k][0].shape[0]
+        if (
+            chunks
+            and models[chunks[-1][-1]].loss == models[k].loss
+            and n_cells * (len(chunks[-1]) + 1) <= max_cells
+        ):
+            chunks[-1].append(k)
+        else:
+            chunks.append([k])
+
+    try:
+        for chunk in chunks:
+            try:
+                _fit_panel_chunk([tasks[k] for k in chunk], [models[k] for k in chunk])
+                fitted = set(chunk)
+            except Exception:
+                logger.exception(
+                    f"panel fit of {len(chunk)} windows failed, fitting them one by one"
+                )
+                fitted = None
+
+            # --- the tasks are fitted again one by one to isolate the failure --- #
+            if fitted is None:
+                fitted = set()
+                for k in chunk:
+                    try:
+                        _fit_panel_chunk([tasks[k]], [models[k]])
+                    except Exception:
+                        if not skip_failed:
+                            raise
+                        logger.exception(
+                            "fit of the window ending on "
+                            f"{tasks[k][0].date.iloc[-1]} failed"
+                        )
+                    else:
+                        fitted.add(k)
+
+            for k in chunk:
+                if k not in fitted:
+                    instrument.count("fit.failed")
+                    yield k, None
+                    continue
+
+                if cache is not None:
+                    cache.set(
+                        cache.key(tasks[k][0], models[k]),
+                        models[k].params,
+                        models[k].convergence.get("success"),
+                    )
+                yield k, result(k)
+    finally:
+        # --- the directory of the cache is scanned once for all the stored fits --- #
+        if cache is not None and pending:
+            cache.evict()
+
+
+def _fit_panel(tasks, seeds, cache=None, max_cells=100_000):
+    """fit the tasks with _iter_panel and return their results in the order of tasks"""
+    results = [None] * len(tasks)
+    for k, result in _iter_panel(tasks, seeds, cache, max_cells):
+        results[k] = result
+
+    return results
+
+
+def compute_panel_predictions(
+    country_kwargs: dict,
+    random_state=None,
+    cache=None,
+    max_cells=100_000,
+    **kwargs,
+):
+    """
+    Run compute_moving_predictions for several countries, fitting the bootstrap
+    samples of every (country, window) pair together with the batched solver. The
+    series of different lengths are padded with zero weight days so that a single
+    vectorized optimisation handles the windows of many countries at once, the
+    results being those of compute_countries_predictions with solver="batched" up to
+    floating point rounding
+
+    Parameters
+    ----------
+    country_kwargs : dictionary {location: keyword arguments of compute_moving_predictions
+        specific to the location, at least X and n_prediction}, see panel_country_kwargs
+    random_state : seed from which the seed of each (country, window) is derived, default=None
+    cache : FitCache from which already computed windows are read, default=None
+    max_cells : maximum number of (bootstrap sample, day) pairs fitted together, small
+        enough for the arrays of a chunk to stay in the processor cache, default=100_000
+    kwargs : keyword arguments of compute_moving_predictions shared by all locations,
+        the solver is always "batched" and only SigmoidModel is supported
+
+    Returns
+    -------
+    predictions and parameters of every country and window with a location column
+    """
+    locations, chains = _countries_chains(country_kwargs, **kwargs)
+    tasks = [task for chain in chains for task in chain]
+    seeds = _spawn_seeds(random_state, len(locations))
+
+    results = _fit_panel(tasks, seeds, cache, max_cells)
+
+    return _predict_countries(locations, results)
+
+
+def iter_panel_predictions(
+    country_kwargs: dict,
+    random_state=None,
+    cache=None,
+    max_cells=100_000,
+    **kwargs,
+):
+    """
+    Fit the moving windows of several countries together like compute_panel_predictions
+    and yield the predictions of each country as soon as all its windows are fitted,
+    so that only the countries of the chunks in progress are held in memory. A country
+    whose fit fails is logged and left out instead of stopping the other countries
+
+    Parameters
+    ----------
+    country_kwargs : dictionary {location: keyword arguments of compute_moving_predictions
+        specific to the location, at least X and n_prediction}, see panel_country_kwargs
+    random_state : seed from which the seed of each (country, window) is derived, default=None
+    cache : FitCache from which already computed windows are read, default=None
+    max_cells : maximum number of (bootstrap sample, day) pairs fitted together,
+        default=100_000
+    kwargs : keyword arguments of compute_moving_predictions shared by all locations,
+        the solver is always "batched" and only SigmoidModel is supported
+
+    Yields
+    ------
+    location, predictions and parameters of all the windows of the location with a
+    location column
+    """
+    locations, chains = _countries_chains(country_kwargs, **kwargs)
+    tasks = [task for chain in chains for task in chain]
+    seeds = _spawn_seeds(random_state, len(locations))
+
+    # --- the results of each location are kept until all its windows are fitted --- #
+    n_remaining = {}
+    for location in locations:
+        n_remaining[location] = n_remaining.get(location, 0) + 1
+    results = {}
+
+    for k, result in _iter_panel(tasks, seeds, cache, max_cells, skip_failed=True):
+        location = locations[k]
+        results.setdefault(location, {})[k] = result
+        n_remaining[location] -= 1
+        if n_remaining[location]:
+            continue
+
+        location_results = [
+            result for _, result in sorted(results.pop(location).items())
+        ]
+        if any(result is None for result in location_results):
+            logger.error(f"{location} left out, the fit of one of its windows failed")
+            continue
+
+        fitted_sigmoid, paramters_values = _predict_countries(
+            [location] * len(location_results), location_results
+        )
+        yield location, fitted_sigmoid, paramters_values